@@ -1,7 +1,11 @@
 from molgenis import client as molgenis
+from requests import RequestException, HTTPError, ConnectTimeout
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import requests
 from yaspin import yaspin
 from termcolor import cprint
-from natsort import natsorted
+from natsort import natsort_keygen
 import time
 import sys
 import random
@@ -9,6 +13,17 @@ import names
 import datetime
 import math
 import getpass
+import itertools
+import json
+import re
+import threading
+import functools
+import os
+import shutil
+import tempfile
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus, unquote, urlparse
 
 
 class NextStep:
@@ -31,55 +46,554 @@ class Execute:
             return True
 
 
-cprint("""################################## MOLGENIS API CLIENT DEMONSTRATION ##################################
-# Before starting:
-# - Start molgenis version 8 or higher on http://localhost:8080, or configure an alternative URL with a Molgenis in the
-# tutorial below
-# - Use PyCharm to write your python code (shortcuts in this tutorial will be given for PyCharm exclusively)
-#
-# This tutorial script contains two classes:
-# - The MolgenisDatabase class will do all Molgenis related calls and is a sort of wrapper around the client to make it
-#   more understandable.
-# - The HospitalSimulation class contains the example we will use to explain the API client. It contains datamodel
-#   specific code and will also use other python libraries.
-#
-# To start with this tutorial scroll down to the main function. The steps of the tutorial will be described shortly.
-# After the description in comments, a few lines of code will follow. ctrl/cmd + click on the functions in the code
-# to see the actual code that is behind the function.
-#
-# Ctrl/cmd + ?/ key to uncomment lines (you may want to skip deleting and uploading data after doing it once).
-""", 'blue')
-NextStep()
+class BackoffWaitStrategy:
+    # Determines how long to wait between two status checks of an import. Short imports are noticed almost right away,
+    # while long imports are checked less and less often (at most every max_interval seconds). The jitter prevents
+    # imports that were started at the same time from polling the server at exactly the same moments.
+    def __init__(self, min_interval=0.1, max_interval=10.0, factor=2.0, jitter=0.1, timeout=3600.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        # Number of seconds after which we stop waiting (None = wait forever)
+        self.timeout = timeout
+
+    def intervals(self):
+        interval = self.min_interval
+        waited = 0.0
+        while self.timeout is None or waited < self.timeout:
+            sleep = min(interval * random.uniform(1 - self.jitter, 1 + self.jitter), self.max_interval)
+            if self.timeout is not None:
+                sleep = min(sleep, self.timeout - waited)
+            yield sleep
+            waited += sleep
+            interval = min(interval * self.factor, self.max_interval)
+
+
+class FixedWaitStrategy(BackoffWaitStrategy):
+    # Checks the status every <interval> seconds, like the demo used to do
+    def __init__(self, interval=2.0, timeout=None):
+        super().__init__(min_interval=interval, max_interval=interval, factor=1.0, jitter=0.0, timeout=timeout)
+
+
+class Metrics:
+    # Counts what the wrapper does: the HTTP requests (per endpoint and entity type, with their duration and the size
+    # of the responses), the calls of the wrapper methods, retries and cache hits. Use summary() for a readable
+    # overview of a run, or to_prometheus() for the Prometheus text format.
+    # Example, the number of requests of one simulated day:
+    # demo.metrics.reset()
+    # simulation.simulate_day()
+    # print(demo.metrics.count('molgenis_requests_total'))
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+    descriptions = {'molgenis_requests_total': 'HTTP requests to MOLGENIS',
+                    'molgenis_request_seconds': 'Duration of the HTTP requests to MOLGENIS',
+                    'molgenis_response_bytes_total': 'Size of the responses of MOLGENIS as sent (before decompressing)',
+                    'molgenis_wrapper_calls_total': 'Calls of MolgenisDatabase methods',
+                    'molgenis_wrapper_seconds': 'Duration of the MolgenisDatabase methods',
+                    'molgenis_retries_total': 'Requests that were tried again',
+                    'molgenis_cache_total': 'Cache lookups by result (hit or miss)'}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def increment(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        with self._lock:
+            counts, total = self.histograms.get(key, ([0] * len(self.buckets), 0.0))
+            counts = [count + 1 if value <= bucket else count for count, bucket in zip(counts, self.buckets)]
+            self.histograms[key] = (counts, total + value)
+
+    def count(self, name, **labels):
+        # Total of a counter (or the number of observations of a histogram), for the label values that match <labels>
+        with self._lock:
+            values = [value for (counter, counter_labels), value in self.counters.items() if
+                      counter == name and set(labels.items()) <= set(counter_labels)]
+            values += [counts[-1] for (histogram, histogram_labels), (counts, _) in self.histograms.items() if
+                       histogram == name and set(labels.items()) <= set(histogram_labels)]
+        return sum(values)
+
+    def seconds(self, name, **labels):
+        # Total duration of the observations of a histogram, for the label values that match <labels>
+        with self._lock:
+            return sum(total for (histogram, histogram_labels), (_, total) in self.histograms.items() if
+                       histogram == name and set(labels.items()) <= set(histogram_labels))
+
+    def record_request(self, method, url, status, seconds, size):
+        endpoint, entity_type = self._parse_url(url)
+        labels = (('method', method), ('endpoint', endpoint), ('entity', entity_type))
+        self.increment('molgenis_requests_total', labels + (('status', str(status)),))
+        self.observe('molgenis_request_seconds', labels, seconds)
+        self.increment('molgenis_response_bytes_total', labels, size)
+
+    @staticmethod
+    def _parse_url(url):
+        # /api/v2/root_hospital_patients/p000000001 becomes endpoint v2/{entity}/{id} and entity root_hospital_patients
+        path = [unquote(part) for part in urlparse(url).path.split('/') if part]
+        if 'api' not in path:
+            return '/'.join(path), ''
+        path = path[path.index('api') + 1:]
+        if len(path) < 2 or path[1] in ('login', 'logout'):
+            return '/'.join(path), ''
+        return '/'.join([path[0], '{entity}'] + ['{id}'] * (len(path) - 2)), path[1]
+
+    def summary(self):
+        # One line per endpoint and entity type with the number of requests, their duration and the response size
+        line = '{:<8} {:<22} {:<36} {:>8} {:>10} {:>12}'
+        lines = [line.format('method', 'endpoint', 'entity', 'requests', 'seconds', 'bytes')]
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            if name == 'molgenis_request_seconds':
+                size = counters.get(('molgenis_response_bytes_total', labels), 0)
+                lines.append(line.format(*[value for _, value in labels], counts[-1], '{:.3f}'.format(total), size))
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            if name == 'molgenis_wrapper_seconds':
+                lines.append(line.format('', dict(labels)['method'] + '()', '', counts[-1], '{:.3f}'.format(total), ''))
+        for (name, labels), value in sorted(counters.items()):
+            if name in ('molgenis_retries_total', 'molgenis_cache_total'):
+                lines.append('{} ({}): {}'.format(name, ', '.join('{}={}'.format(*label) for label in labels), value))
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        for name in sorted({name for name, _ in counters}):
+            lines += ['# HELP {} {}'.format(name, self.descriptions.get(name, name)), '# TYPE {} counter'.format(name)]
+            lines += ['{}{} {}'.format(name, self._format_labels(labels), value) for (counter, labels), value in
+                      sorted(counters.items()) if counter == name]
+        for name in sorted({name for name, _ in histograms}):
+            lines += ['# HELP {} {}'.format(name, self.descriptions.get(name, name)),
+                      '# TYPE {} histogram'.format(name)]
+            for (histogram, labels), (counts, total) in sorted(histograms.items()):
+                if histogram != name:
+                    continue
+                for bucket, count in zip(self.buckets, counts):
+                    bucket_label = ('le', '+Inf' if bucket == float('inf') else str(bucket))
+                    lines.append('{}_bucket{} {}'.format(name, self._format_labels(labels + (bucket_label,)), count))
+                lines.append('{}_sum{} {}'.format(name, self._format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(name, self._format_labels(labels), counts[-1]))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for label, value in labels) + '}'
+
+
+def instrumented(method):
+    # Counts the calls of a MolgenisDatabase method and how long they take
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            labels = (('method', method.__name__),)
+            self.metrics.increment('molgenis_wrapper_calls_total', labels)
+            self.metrics.observe('molgenis_wrapper_seconds', labels, time.perf_counter() - started)
+    return wrapper
+
+
+class TimedCache:
+    # Remembers values for <ttl> seconds. Keys are tuples that start with the entity type, so everything that is known
+    # about one entity type can be forgotten at once when its data changes.
+    def __init__(self, ttl=60.0, metrics=None, name='metadata'):
+        self.ttl = ttl
+        self.metrics = metrics
+        self.name = name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        if self.metrics is not None:
+            self.metrics.increment('molgenis_cache_total', (('cache', self.name),
+                                                            ('result', 'miss' if value is None else 'hit')))
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._values:
+                expires, value = self._values[key]
+                if time.time() < expires:
+                    return value
+                del self._values[key]
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._values[key] = (time.time() + self.ttl, value)
+
+    def invalidate(self, entity_type=None, package=None):
+        # Without arguments the whole cache is cleared
+        with self._lock:
+            for key in list(self._values):
+                if (entity_type is None and package is None) or key[0] == entity_type or (
+                        package is not None and key[0].startswith(package + '_')):
+                    del self._values[key]
+
+
+class QueryCache(TimedCache):
+    # Remembers query results for <ttl> seconds. When the results together take more than <max_size> bytes (as JSON),
+    # the results that were used longest ago are forgotten first.
+    # Rows contain the ids and labels (or more, when expanded) of the rows they refer to, so the results of an entity
+    # type are also forgotten when an entity type they refer to changes: patients with the label of their residence
+    # when root_cities changes. The v2 API gives every (referenced) row an _href with its entity type.
+    href_pattern = re.compile(r'"_href": "/api/v2/([^/"]+)/')
+
+    def __init__(self, ttl=60.0, max_size=50 * 1024 * 1024, metrics=None, name='query'):
+        super().__init__(ttl, metrics, name)
+        self.max_size = max_size
+        self.size = 0
+        self._values = OrderedDict()
+        self._sizes = {}
+        self._references = {}
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._values:
+                expires, value = self._values[key]
+                if time.time() < expires:
+                    self._values.move_to_end(key)
+                    return value
+                self._remove(key)
+        return None
+
+    def put(self, key, value):
+        value_as_json = json.dumps(value)
+        size = len(value_as_json)
+        if size > self.max_size:
+            return
+        references = {unquote(entity_type) for entity_type in self.href_pattern.findall(value_as_json)}
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+            self._values[key] = (time.time() + self.ttl, value)
+            self._sizes[key] = size
+            self._references[key] = references
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._values)))
+
+    def invalidate(self, entity_type=None, package=None):
+        # Without arguments the whole cache is cleared. Everything is removed in one pass under the lock, so the sizes
+        # always match the results that are in the cache.
+        with self._lock:
+            for key in list(self._values):
+                entity_types = {key[0]} | self._references[key]
+                if (entity_type is None and package is None) or entity_type in entity_types or (
+                        package is not None and any(name.startswith(package + '_') for name in entity_types)):
+                    self._remove(key)
+
+    def _remove(self, key):
+        self._values.pop(key, None)
+        self._references.pop(key, None)
+        self.size -= self._sizes.pop(key)
+
+
+class PooledSession(requests.Session):
+    # A requests session that keeps up to <pool_size> connections to the server open, so the connection (and TLS)
+    # does not have to be set up again for every request. When all connections are in use, a thread waits for a free
+    # connection instead of opening an extra one. The threads of the wrapper share this session. requests does not
+    # promise that a Session is thread safe, but what is shared here is: the connection pool of urllib3 is, and the
+    # login token is sent as a header that is only read after logging in. Cookies the server sets end up in the shared
+    # cookie jar (the standard library locks it), so do not rely on cookies being per thread.
+    def __init__(self, pool_size=4, timeout=(10, 300), metrics=None):
+        super().__init__()
+        # (connect timeout, read timeout) in seconds, used when a request does not specify a timeout itself
+        self.timeout = timeout
+        self.metrics = metrics
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.metrics is None:
+            return super().request(method, url, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except RequestException:
+            self.metrics.record_request(method, url, 'error', time.perf_counter() - started, 0)
+            raise
+        self.metrics.record_request(method, url, response.status_code, time.perf_counter() - started,
+                                    self.get_response_size(response))
+        return response
+
+    @staticmethod
+    def get_response_size(response):
+        # The number of bytes the server sent, which is the Content-Length: response.content is decompressed already.
+        # Chunked responses have no Content-Length, for those the bytes urllib3 read from the connection are used. When
+        # urllib3 does not count them (it does not for chunked responses in all versions), the size of the
+        # decompressed body is the best we have.
+        if 'Content-Length' in response.headers:
+            return int(response.headers['Content-Length'])
+        return getattr(response.raw, 'tell', lambda: 0)() or len(response.content)
+
+
+class ArrowConverter:
+    # Converts rows of the v2 API into Arrow record batches, using the meta data of the entity type for the columns:
+    # - references (xref, categorical, file) become two columns: <attribute> with the id and <attribute>_label
+    # - multiple references (mref, categorical mref, one to many) become two columns with lists of ids and labels
+    # - categoricals, enums and the <dictionary_columns> are dictionary encoded: every value is stored once per batch
+    #   and the rows only store a number, which makes a huge difference for columns like gender and residence
+    # Attributes without meta data get their type from the first page.
+    arrow_types = {'INT': 'int32', 'LONG': 'int64', 'DECIMAL': 'float64', 'BOOL': 'bool_', 'DATE': 'date32'}
+    reference_types = ('XREF', 'CATEGORICAL', 'FILE')
+    multiple_reference_types = ('MREF', 'CATEGORICAL_MREF', 'ONE_TO_MANY')
+    dictionary_types = ('CATEGORICAL', 'CATEGORICAL_MREF', 'ENUM')
+
+    def __init__(self, meta, dictionary_columns=None):
+        import pyarrow
+        self.pyarrow = pyarrow
+        self.dictionary_columns = set(dictionary_columns or [])
+        self.columns = None
+        if meta.get('attributes'):
+            self.columns = [column for attribute in meta['attributes'] for column in self._get_columns(attribute)]
+
+    def _get_columns(self, attribute):
+        # Returns (name, kind, arrow type, id attribute of reference, label attribute of reference, dictionary)
+        field_type = attribute.get('fieldType')
+        if field_type == 'COMPOUND':
+            return [column for part in attribute.get('attributes', []) for column in self._get_columns(part)]
+        name = attribute['name']
+        dictionary = field_type in self.dictionary_types or name in self.dictionary_columns
+        ref_entity = attribute.get('refEntity') or {}
+        ref_id, ref_label = ref_entity.get('idAttribute'), ref_entity.get('labelAttribute')
+        if field_type in self.reference_types:
+            return [(name, 'reference', 'string', ref_id, ref_label, dictionary)]
+        if field_type in self.multiple_reference_types:
+            return [(name, 'references', 'string', ref_id, ref_label, dictionary)]
+        return [(name, 'value', self.arrow_types.get(field_type, 'string'), None, None, dictionary)]
+
+    def _guess_columns(self, rows):
+        columns = OrderedDict()
+        for row in rows:
+            for name, value in row.items():
+                if name.startswith('_') or name in columns and columns[name][1] != 'unknown':
+                    continue
+                dictionary = name in self.dictionary_columns
+                if isinstance(value, dict):
+                    columns[name] = (name, 'reference', 'string', None, None, dictionary)
+                elif isinstance(value, list):
+                    columns[name] = (name, 'references', 'string', None, None, dictionary)
+                elif value is None:
+                    columns[name] = (name, 'unknown', 'string', None, None, dictionary)
+                else:
+                    arrow_type = self.pyarrow.array([value]).type
+                    columns[name] = (name, 'value', arrow_type, None, None, dictionary)
+        return [(name, 'value' if kind == 'unknown' else kind, arrow_type, ref_id, ref_label, dictionary)
+                for name, kind, arrow_type, ref_id, ref_label, dictionary in columns.values()]
+
+    @staticmethod
+    def reference_id_and_label(reference, ref_id, ref_label):
+        if not isinstance(reference, dict):
+            return reference, None
+        if ref_id is None:
+            # Without meta data, the id and label are the first two attributes of the reference
+            keys = [key for key in reference if not key.startswith('_')] or [None]
+            ref_id, ref_label = keys[0], keys[1] if len(keys) > 1 else keys[0]
+        return reference.get(ref_id), reference.get(ref_label)
+
+    def _array(self, values, arrow_type, dictionary):
+        if isinstance(arrow_type, str):
+            arrow_type = getattr(self.pyarrow, arrow_type)()
+        if arrow_type == self.pyarrow.date32():
+            values = [datetime.date.fromisoformat(value) if value else None for value in values]
+        array = self.pyarrow.array(values, type=arrow_type)
+        return array.dictionary_encode() if dictionary else array
+
+    def to_record_batch(self, rows):
+        if self.columns is None:
+            self.columns = self._guess_columns(rows)
+        arrays = []
+        names = []
+        for name, kind, arrow_type, ref_id, ref_label, dictionary in self.columns:
+            values = [row.get(name) for row in rows]
+            if kind == 'reference':
+                ids_and_labels = [self.reference_id_and_label(value, ref_id, ref_label) for value in values]
+                ids = [self._str_or_none(ref[0]) for ref in ids_and_labels]
+                labels = [self._str_or_none(ref[1]) for ref in ids_and_labels]
+                arrays += [self._array(ids, 'string', dictionary), self._array(labels, 'string', dictionary)]
+                names += [name, name + '_label']
+            elif kind == 'references':
+                ids_and_labels = [[self.reference_id_and_label(reference, ref_id, ref_label) for reference in
+                                   value or []] for value in values]
+                ids = [[self._str_or_none(ref[0]) for ref in refs] for refs in ids_and_labels]
+                labels = [[self._str_or_none(ref[1]) for ref in refs] for refs in ids_and_labels]
+                list_type = self.pyarrow.list_(self.pyarrow.string())
+                arrays += [self.pyarrow.array(ids, type=list_type), self.pyarrow.array(labels, type=list_type)]
+                names += [name, name + '_label']
+            else:
+                arrays.append(self._array(values, arrow_type, dictionary))
+                names.append(name)
+        return self.pyarrow.RecordBatch.from_arrays(arrays, names=names)
+
+    @staticmethod
+    def _str_or_none(value):
+        return None if value is None else str(value)
 
 
 class MolgenisDatabase:
-    def __init__(self, molgenis_server, admin_password):
+    def __init__(self, molgenis_server, admin_password, metadata_ttl=60.0, query_cache_ttl=60.0,
+                 query_cache_size=50 * 1024 * 1024, concurrency=4, timeout=(10, 300)):
 
         api_url = molgenis_server + '/api/'
-        # Create molgenis session with specified server
+        # Number of requests the wrapper does at the same time when it can do requests in parallel. This is also the
+        # upper bound: the connection pool has <concurrency> connections, so when a method is called with more
+        # workers (or a higher concurrency), the extra threads wait for a free connection.
+        self.concurrency = concurrency
+        # Create molgenis session with specified server, using a connection pool with a connection for each thread
         self.molgenis_client = molgenis.Session(api_url)
+        # Everything the wrapper does is counted in the metrics
+        self.metrics = Metrics()
+        self.session = PooledSession(concurrency, timeout, self.metrics)
+        self.molgenis_client._session = self.session
         # Login as admin to server
         self.molgenis_client.login('admin', admin_password)
-
-    def upload_data(self, file_to_upload):
+        self._upload_executor = None
+        # The metadata and the total number of rows of the tables are cached to prevent requesting them over and over
+        # again. Changes made using this wrapper clear the cache of the changed table.
+        self.metadata_cache = TimedCache(metadata_ttl, self.metrics)
+        # Results of get requests are cached in the same way, so asking the same question twice costs one request
+        self.query_cache = QueryCache(query_cache_ttl, query_cache_size, self.metrics)
+
+    @instrumented
+    def upload_data(self, file_to_upload, wait_strategy=None, validate=False):
+        # With validate=True, an EMX workbook (.xlsx) is checked before it is uploaded (see validate_emx), so problems
+        # are found in seconds instead of after the server tried to import the whole file.
+        if validate:
+            self.check_emx(file_to_upload)
         # Response is an URL on which the status of the import can be checked
         # Uploading files (datamodels) can be done using the upload_zip endpoint
         response = self.molgenis_client.upload_zip(file_to_upload)
-        self.check_status(response)
-
-    def check_status(self, url):
-        # Split the URL and get the last part of it (=id)
-        entity_id = url.split('/')[-1]
-        import_run = self.molgenis_client.get_by_id('sys_ImportRun', entity_id)
-        status = import_run['status']
+        try:
+            return self.check_status(response, wait_strategy)
+        finally:
+            # We do not know which tables the file contains, so forget everything
+            self.invalidate_cache()
+
+    def upload_data_async(self, file_to_upload, wait_strategy=None):
+        # Starts the upload in the background and returns a future right away, so several files can be imported at the
+        # same time. Use future.result() to wait for the import; the result is the sys_ImportRun row of the import.
+        # Example:
+        # futures = [demo.upload_data_async(file) for file in files]
+        # import_runs = [future.result() for future in futures]
+        if self._upload_executor is None:
+            self._upload_executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self._upload_executor.submit(self._upload_and_wait, file_to_upload, wait_strategy)
+
+    def _upload_and_wait(self, file_to_upload, wait_strategy):
+        response = self.molgenis_client.upload_zip(file_to_upload)
+        try:
+            return self.wait_for_import(response, wait_strategy)
+        finally:
+            self.invalidate_cache()
+
+    @instrumented
+    def validate_emx(self, file_to_validate, max_errors=100):
+        # Checks an EMX workbook locally, see EmxWorkbook.iter_problems for what is checked. The entity types that the
+        # workbook uses but does not define are looked up on the server. Returns the problems that were found (at most
+        # <max_errors>), an empty list means the workbook can be imported. Needs openpyxl (pip3 install -e .[emx]).
+        from emx import EmxWorkbook
+        with EmxWorkbook(file_to_validate) as workbook:
+            return workbook.validate(self.get_existing_entity_types(workbook.get_external_entity_types()), max_errors)
+
+    def check_emx(self, file_to_validate):
+        # Same as validate_emx, but raises an EmxValidationError with all problems when something is wrong
+        from emx import EmxValidationError
+        errors = self.validate_emx(file_to_validate)
+        if errors:
+            raise EmxValidationError(errors)
+
+    def get_existing_entity_types(self, entity_types):
+        existing = []
+        for entity_type in entity_types:
+            try:
+                self.get_meta(entity_type)
+                existing.append(entity_type)
+            except HTTPError:
+                pass
+        return existing
+
+    @instrumented
+    def upload_data_in_chunks(self, file_to_upload, chunk_size=10000, wait_strategy=None, validate=True):
+        # Uploads a large EMX workbook in parts, which the server imports at the same time:
+        # 1) the workbook is checked locally (see validate_emx), problems raise an EmxValidationError before anything
+        #    is uploaded
+        # 2) it is split into workbooks of at most <chunk_size> rows, which are imported in waves (see
+        #    EmxWorkbook.split): first the data model, then the rows, never before the rows they refer to
+        # 3) all chunks of a wave are uploaded at the same time (see upload_data_async), the next wave starts when they
+        #    are all imported. When a chunk fails, the next waves are skipped.
+        # Returns the chunks with their wave, number of rows and the status and message of their import.
+        # Needs openpyxl (pip3 install -e .[emx]).
+        from emx import EmxWorkbook
+        if validate:
+            self.check_emx(file_to_upload)
+        directory = tempfile.mkdtemp(prefix='molgenis_upload_')
+        try:
+            with EmxWorkbook(file_to_upload) as workbook:
+                chunks = workbook.split(directory, chunk_size)
+            return self._upload_chunks(chunks, wait_strategy)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _upload_chunks(self, chunks, wait_strategy):
+        number_of_waves = chunks[-1]['wave'] + 1
+        failed = False
+        with yaspin(text='Uploading data', color='green') as spinner:
+            for wave, wave_chunks in itertools.groupby(chunks, key=lambda chunk: chunk['wave']):
+                wave_chunks = list(wave_chunks)
+                if failed:
+                    for chunk in wave_chunks:
+                        chunk.update(status='SKIPPED', message='An earlier chunk failed')
+                    continue
+                spinner.text = 'Uploading data (wave {} of {}, {} chunks)'.format(wave + 1, number_of_waves,
+                                                                                 len(wave_chunks))
+                futures = [self.upload_data_async(chunk['path'], wait_strategy) for chunk in wave_chunks]
+                for chunk, future in zip(wave_chunks, futures):
+                    try:
+                        import_run = future.result()
+                        chunk.update(status=import_run['status'], message=import_run.get('message'),
+                                     import_run=import_run['id'])
+                    except (molgenis.MolgenisRequestError, RequestException, TimeoutError) as error:
+                        chunk.update(status='FAILED', message=str(error))
+                    failed = failed or chunk['status'] != 'FINISHED'
+
+            if failed:
+                spinner.fail('💥')
+                for chunk in chunks:
+                    if chunk['status'] == 'FAILED':
+                        cprint('Import of {} failed: {}'.format(os.path.basename(chunk['path']), chunk['message']),
+                               'red', attrs=['bold'], file=sys.stderr)
+            else:
+                spinner.ok("✔")
+        return chunks
 
+    @instrumented
+    def check_status(self, url, wait_strategy=None):
         # Poll the status
         with yaspin(text='Uploading data', color='green') as spinner:
-            while status == 'RUNNING':
-                # Build in some sleep to prevent the script from spamming the server too much
-                time.sleep(2)
-                import_run = self.molgenis_client.get_by_id('sys_ImportRun', entity_id)
-                status = import_run['status']
+            import_run = self.wait_for_import(url, wait_strategy)
+            status = import_run['status']
 
             if status == 'FAILED':
                 spinner.fail('💥')
@@ -87,35 +601,319 @@ class MolgenisDatabase:
 
             elif status == 'FINISHED':
                 spinner.ok("✔")
+        return import_run
 
-    def get_total(self, entity_type):
-        # Get data and meta data using the raw=True. By default raw = False, then the get request will only return the
-        # items(=data) in the response.
-        response = self.molgenis_client.get(entity_type, raw=True)
-        return response['total']
-
-    def get_meta(self, entity_type):
-        response = self.molgenis_client.get(entity_type, raw=True)
-        return response['meta']
-
-    def get_with_query(self, entity_type, query):
-        data = self.molgenis_client.get(entity_type, q=query)
+    @instrumented
+    def wait_for_import(self, url, wait_strategy=None):
+        # Split the URL and get the last part of it (=id)
+        entity_id = url.split('/')[-1]
+        import_run = self.molgenis_client.get_by_id('sys_ImportRun', entity_id)
+        if wait_strategy is None:
+            wait_strategy = BackoffWaitStrategy()
+
+        for interval in wait_strategy.intervals():
+            if import_run['status'] != 'RUNNING':
+                break
+            # Build in some sleep to prevent the script from spamming the server too much
+            time.sleep(interval)
+            import_run = self.molgenis_client.get_by_id('sys_ImportRun', entity_id)
+
+        if import_run['status'] == 'RUNNING':
+            raise TimeoutError('Import {} still running after {} seconds'.format(entity_id, wait_strategy.timeout))
+        return import_run
+
+    @instrumented
+    def get_total(self, entity_type, q=None):
+        total = self.metadata_cache.get((entity_type, 'total', q))
+        if total is None:
+            total = self._get_without_rows(entity_type, q)['total']
+        return total
+
+    @instrumented
+    def get_meta(self, entity_type, attributes=None, expand=None):
+        # With attributes and/or expand, only the meta data of those attributes is returned
+        attrs = self.build_attrs(attributes, expand)
+        meta = self.metadata_cache.get((entity_type, 'meta', attrs))
+        if meta is None:
+            meta = self._get_without_rows(entity_type, attrs=attrs)['meta']
+        return meta
+
+    def _get_without_rows(self, entity_type, q=None, attrs=None):
+        # With num=0 the server only returns the meta data and the total number of rows, which is a lot faster than
+        # retrieving a page of 100 rows we do not need.
+        response = self.get_page(entity_type, q=q, attrs=attrs, num=0)
+        self.metadata_cache.put((entity_type, 'meta', attrs), response['meta'])
+        self.metadata_cache.put((entity_type, 'total', q), response['total'])
+        return response
+
+    @instrumented
+    def get_with_query(self, entity_type, query, attributes=None, expand=None):
+        data = self.cached_get(entity_type, q=query, attributes=attributes, expand=expand)
         return data
 
-    def get(self, entity_type):
+    @instrumented
+    def get(self, entity_type, attributes=None, expand=None):
         # Max number of values to retrieve is 10000, default num = 100
-        data = self.molgenis_client.get(entity_type)
+        data = self.cached_get(entity_type, attributes=attributes, expand=expand)
         return data
 
-    def get_num(self, entity_type, num):
-        data = self.molgenis_client.get(entity_type, num=num)
+    @instrumented
+    def get_num(self, entity_type, num, attributes=None, expand=None):
+        data = self.cached_get(entity_type, num=num, attributes=attributes, expand=expand)
         return data
 
+    @instrumented
+    def cached_get(self, entity_type, q=None, attributes=None, expand=None, sort_column=None, sort_order=None,
+                   num=100, start=0):
+        # Same as molgenis_client.get, but the result is remembered until the cache expires or this wrapper changes
+        # data in the table. The rows are shared between calls, so do not change them.
+        attrs = self.build_attrs(attributes, expand)
+        key = (entity_type, q, attrs, sort_column, sort_order, num, start)
+        data = self.query_cache.get(key)
+        if data is None:
+            data = self.get_page(entity_type, q=q, attrs=attrs, sort_column=sort_column, sort_order=sort_order,
+                                 num=num, start=start)['items']
+            self.query_cache.put(key, data)
+        return list(data)
+
+    @instrumented
+    def get_page(self, entity_type, q=None, attrs=None, sort_column=None, sort_order=None, num=100, start=0):
+        # Does the get request of the v2 API and returns the complete response (like raw=True in the client). The
+        # client only supports expanding references completely, so we build the request ourselves to be able to
+        # pass nested attribute selections like children(id,firstName) and num=0.
+        params = {'num': num, 'start': start}
+        if q:
+            params['q'] = q
+        if attrs:
+            params['attrs'] = attrs
+        if sort_column:
+            params['sort'] = sort_column + (':' + sort_order if sort_order else '')
+        response = self.session.get(self.molgenis_client._url + 'v2/' + quote_plus(entity_type),
+                                    headers=self.molgenis_client._get_token_header(), params=params)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def build_attrs(attributes=None, expand=None):
+        # Builds the attrs parameter of the v2 API, which decides which columns (and which columns of referenced rows)
+        # are returned. Less columns means less data to send and to decode, which makes a big difference for tables
+        # with a lot of (reference) columns.
+        # attributes: the columns to retrieve, as list or comma separated string. Use attribute(sub1,sub2) to select
+        #             the columns of a reference, for instance 'id,children(id,firstName)'.
+        # expand: the references to expand, as a list (all columns of the referenced rows) or as a dictionary with the
+        #         columns to retrieve per reference, for instance {'department': 'label', 'children': ['id']}.
+        # Without attributes and expand, the server decides (all columns, references with their id and label).
+        if isinstance(attributes, str):
+            attributes = re.split(r',(?![^(]*\))', attributes)
+        attrs = [attribute.strip() for attribute in attributes or []]
+        if not expand:
+            return ','.join(attrs) or None
+        if not isinstance(expand, dict):
+            expand = {reference: '*' for reference in expand}
+        if not attrs:
+            attrs = ['*']
+
+        attrs = [attr for attr in attrs if attr.split('(')[0] not in expand]
+        for reference, sub_attributes in expand.items():
+            if not isinstance(sub_attributes, str):
+                sub_attributes = ','.join(sub_attributes)
+            attrs.append('{}({})'.format(reference, sub_attributes))
+        return ','.join(attrs)
+
+    def invalidate_cache(self, entity_type=None, package=None):
+        # Forget what we know about a table (or all tables in a package, or everything when called without arguments),
+        # including the query results of other tables that contain its rows as references
+        self.metadata_cache.invalidate(entity_type, package)
+        self.query_cache.invalidate(entity_type, package)
+
+    def iter_rows(self, entity_type, q=None, attributes=None, expand=None, page_size=10000, concurrency=None):
+        # Yields all rows of an entity type, also when the table has more than 10000 rows (the maximum num of one get).
+        # The rows are yielded in the same order as the server returns them.
+        for page in self.iter_pages(entity_type, q=q, attributes=attributes, expand=expand, page_size=page_size,
+                                    concurrency=concurrency):
+            for row in page:
+                yield row
+
+    def iter_pages(self, entity_type, q=None, attributes=None, expand=None, page_size=10000, concurrency=None):
+        # Yields the rows of an entity type page by page (lists of at most <page_size> rows). The first page tells us
+        # the total, after that the other pages are requested in parallel. At most <concurrency> pages are in flight
+        # at the same time, so the memory use does not grow with the size of the table. No more pages are requested
+        # at the same time than the concurrency of the wrapper allows, see __init__.
+        concurrency = concurrency or self.concurrency
+        attrs = self.build_attrs(attributes, expand)
+        first_page = self.get_page(entity_type, q=q, attrs=attrs, num=page_size)
+        yield first_page['items']
+
+        starts = range(page_size, first_page['total'], page_size)
+        if not starts:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pages_in_flight = deque()
+        try:
+            for start in starts:
+                pages_in_flight.append(executor.submit(self.get_page, entity_type, q=q, attrs=attrs, num=page_size,
+                                                       start=start))
+                # Only wait for the oldest page when the maximum number of pages is in flight
+                if len(pages_in_flight) >= concurrency:
+                    yield pages_in_flight.popleft().result()['items']
+            while pages_in_flight:
+                yield pages_in_flight.popleft().result()['items']
+        finally:
+            # When the caller stops iterating halfway, do not fetch the pages that did not start yet
+            for page in pages_in_flight:
+                page.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_record_batches(self, entity_type, q=None, attributes=None, expand=None, dictionary_columns=None,
+                            page_size=10000):
+        # Yields the rows of an entity type as Arrow record batches (one per page), see ArrowConverter for the columns.
+        # Needs pyarrow (pip3 install -e .[columnar]).
+        converter = ArrowConverter(self.get_meta(entity_type, attributes, expand), dictionary_columns)
+        for page in self.iter_pages(entity_type, q=q, attributes=attributes, expand=expand, page_size=page_size):
+            yield converter.to_record_batch(page)
+
+    @instrumented
+    def to_arrow(self, entity_type, q=None, attributes=None, expand=None, dictionary_columns=None, page_size=10000):
+        # Returns the table as an Arrow table, which takes a lot less memory than a list of dictionaries
+        import pyarrow
+        batches = list(self.iter_record_batches(entity_type, q=q, attributes=attributes, expand=expand,
+                                                dictionary_columns=dictionary_columns, page_size=page_size))
+        return pyarrow.Table.from_batches(batches)
+
+    @instrumented
+    def to_dataframe(self, entity_type, q=None, attributes=None, expand=None, dictionary_columns=None,
+                     page_size=10000):
+        # Returns the table as a pandas DataFrame, the dictionary columns become categorical columns
+        return self.to_arrow(entity_type, q=q, attributes=attributes, expand=expand,
+                             dictionary_columns=dictionary_columns, page_size=page_size).to_pandas()
+
+    @instrumented
+    def to_parquet(self, entity_type, path, q=None, attributes=None, expand=None, dictionary_columns=None,
+                   page_size=10000):
+        # Writes the table to a parquet file page by page, so the table never has to fit in memory. Returns the
+        # number of rows written.
+        import pyarrow.parquet
+        number_of_rows = 0
+        writer = None
+        try:
+            for batch in self.iter_record_batches(entity_type, q=q, attributes=attributes, expand=expand,
+                                                  dictionary_columns=dictionary_columns, page_size=page_size):
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+                writer.write_batch(batch)
+                number_of_rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return number_of_rows
+
+    def join(self, left_entity, right_entity, left_on, right_on=None, how='inner', left_q=None, right_q=None,
+             left_attributes=None, right_attributes=None, page_size=10000):
+        # Combines the rows of two tables, like a join in SQL. Yields (left row, right row) tuples, with None as right
+        # row for left rows without match when how='left'. The right table is retrieved completely and indexed on
+        # <right_on> (the id attribute of the right table by default), after that the left table is streamed page
+        # by page, so each row is looked up once instead of comparing every row with every other row.
+        # The keys can be (multiple) references: a left row with children [a, b] is combined with both a and b.
+        # Example, the departments of the employees:
+        # demo.join('root_hospital_employees', 'root_hospital_departments', left_on='department')
+        if how not in ('inner', 'left'):
+            raise ValueError('Unsupported join: {}, use inner or left'.format(how))
+        right_on = right_on or self.get_meta(right_entity)['idAttribute']
+        index = self.build_index(self.iter_rows(right_entity, q=right_q, attributes=self._with_key(
+            right_attributes, right_on), page_size=page_size), right_on)
+
+        for left_row in self.iter_rows(left_entity, q=left_q, attributes=self._with_key(left_attributes, left_on),
+                                       page_size=page_size):
+            matched = False
+            for key in self.get_keys(left_row.get(left_on), right_on):
+                for right_row in index.get(key, []):
+                    matched = True
+                    yield left_row, right_row
+            if not matched and how == 'left':
+                yield left_row, None
+
+    @staticmethod
+    def _with_key(attributes, key):
+        # Make sure the key is retrieved when only some attributes are retrieved
+        if attributes is None:
+            return None
+        if isinstance(attributes, str):
+            attributes = re.split(r',(?![^(]*\))', attributes)
+        return attributes if key in [attribute.split('(')[0] for attribute in attributes] else attributes + [key]
+
+    @classmethod
+    def build_index(cls, rows, key_attribute):
+        # Returns a dictionary with for each value of the key attribute the rows with that value
+        index = {}
+        for row in rows:
+            for key in cls.get_keys(row.get(key_attribute)):
+                index.setdefault(key, []).append(row)
+        return index
+
+    @staticmethod
+    def get_keys(value, id_attr=None):
+        # Returns the values to match on: the value itself, the id of a reference or the ids of multiple references
+        values = value if isinstance(value, list) else [value]
+        keys = []
+        for item in values:
+            if isinstance(item, dict):
+                item = item[id_attr] if id_attr in item else ArrowConverter.reference_id_and_label(item, None, None)[0]
+            if item is not None:
+                keys.append(item)
+        return keys
+
+    @classmethod
+    def group_by(cls, rows, key, reducer=None, initial=0):
+        # Groups the rows on a key while streaming over them, and returns a dictionary with a result per group.
+        # key: an attribute (references are grouped on their id) or a function that returns the key of a row
+        # reducer: function(result so far, row) that returns the new result, by default the rows are counted
+        # Example, the number of patients per residence:
+        # demo.group_by(demo.iter_rows('root_hospital_patients', attributes='residence'), 'residence')
+        reducer = reducer or (lambda total, row: total + 1)
+        groups = {}
+        for row in rows:
+            keys = [key(row)] if callable(key) else cls.get_keys(row.get(key)) or [None]
+            for group in keys:
+                groups[group] = reducer(groups.get(group, initial), row)
+        return groups
+
+    @instrumented
     def delete_package(self, package):
         response = self.molgenis_client.delete('sys_md_Package', package)
         response.raise_for_status()
+        self.invalidate_cache(package=package)
         print('Package "{}" deleted'.format(package))
 
+    @instrumented
+    def resolve_references(self, entity_type, ids, ref_attrs=None, attributes=None, batch_size=100, workers=None):
+        # Retrieves the rows with the given ids as a dictionary with the id as key, with the references in ref_attrs
+        # expanded (see build_attrs for the options of ref_attrs and attributes). Instead of one request per id, the
+        # ids are combined into =in= queries of <batch_size> ids, and ids that are asked for more than once are only
+        # requested once. More workers than the concurrency of the wrapper do not make it faster, see __init__.
+        workers = workers or self.concurrency
+        id_attr = self.get_meta(entity_type)['idAttribute']
+        # The rows are returned by id, so the id is always retrieved
+        attributes = self._with_key(attributes, id_attr)
+        unique_ids = list(OrderedDict.fromkeys(ids))
+        batches = [unique_ids[start:start + batch_size] for start in range(0, len(unique_ids), batch_size)]
+
+        def get_batch(batch):
+            query = '{}=in=({})'.format(id_attr, ','.join(str(entity_id) for entity_id in batch))
+            return self.cached_get(entity_type, q=query, attributes=attributes, expand=ref_attrs, num=len(batch))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = [row for batch_rows in executor.map(get_batch, batches) for row in batch_rows]
+        return {row[id_attr]: row for row in rows}
+
+    @instrumented
+    def delete_values(self, entity_type, ids):
+        try:
+            self.molgenis_client.delete_list(entity_type, ids)
+        finally:
+            self.invalidate_cache(entity_type)
+
+    @instrumented
     def add_values(self, entity_type, values):
         # Max number of values per call = 1000
         # Values is a list of dictionaries. The dictionaries with as key the id of the column and as value the assigned
@@ -124,23 +922,324 @@ class MolgenisDatabase:
         # id's of your values as value of the column id.
         # Example of values:
         # [{id: "id1", reference: "val1", multiple: ["ref1", "ref2"]}]
-        self.molgenis_client.add_all(entity_type, values)
+        try:
+            self.molgenis_client.add_all(entity_type, values)
+        finally:
+            self.invalidate_cache(entity_type)
+
+    @instrumented
+    def add_values_bulk(self, entity_type, values, batch_size=1000, workers=None, retries=3):
+        # Adds any number of values (a list, or a generator if you do not want to keep all rows in memory). The values
+        # are split into batches of at most 1000 rows (the maximum of add_all) and the batches are sent in parallel.
+        # A batch that fails because of a server or connection error is retried with an increasing wait time, when it
+        # keeps failing the id (number) of the batch is reported in the summary and the other batches continue.
+        # Before a retry, the rows that were stored after all (the server might have processed a batch whose response
+        # timed out or was replaced by a proxy error) are left out, so the retry does not fail on duplicate ids.
+        # Up to <workers> batches are read ahead, but no more batches are sent at the same time than the concurrency of
+        # the wrapper allows (see __init__).
+        workers = workers or self.concurrency
+        summary = {'rows_written': 0, 'batches': 0, 'failed_batches': [], 'rows_per_second': 0.0}
+        started = time.time()
+        values = iter(values)
+
+        def finish(batch_id, batch_in_flight):
+            try:
+                summary['rows_written'] += batch_in_flight.result()
+            except (molgenis.MolgenisRequestError, RequestException):
+                summary['failed_batches'].append(batch_id)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batches_in_flight = deque()
+            for batch_id in itertools.count():
+                batch = list(itertools.islice(values, batch_size))
+                if not batch:
+                    break
+                summary['batches'] += 1
+                batches_in_flight.append(
+                    (batch_id, executor.submit(self._add_batch_with_retries, entity_type, batch, retries)))
+                # Do not read more values from the input than the workers can handle
+                if len(batches_in_flight) >= workers:
+                    finish(*batches_in_flight.popleft())
+            while batches_in_flight:
+                finish(*batches_in_flight.popleft())
+
+        self.invalidate_cache(entity_type)
+        duration = time.time() - started
+        if duration > 0:
+            summary['rows_per_second'] = summary['rows_written'] / duration
+        return summary
+
+    def _add_batch_with_retries(self, entity_type, batch, retries):
+        # After a failure that the server might have processed (a read timeout or a 5xx), the next attempt first looks
+        # up which rows of the batch exist and only posts the others. While the server is unreachable that lookup
+        # fails as well, which is just another failed attempt: it is tried again after the next wait.
+        number_of_rows = len(batch)
+        error_to_check = None
+        for attempt in range(retries + 1):
+            try:
+                if error_to_check is not None:
+                    unwritten_rows = self._get_unwritten_rows(entity_type, batch)
+                    if unwritten_rows is None:
+                        break
+                    batch, error_to_check = unwritten_rows, None
+                    if not batch:
+                        return number_of_rows
+                self._post_batch(entity_type, batch)
+                return number_of_rows
+            except RequestException as error:
+                if attempt == retries or not self.is_transient_error(error):
+                    raise
+                if error_to_check is None and not self.is_not_sent(error):
+                    error_to_check = error
+                self.metrics.increment('molgenis_retries_total', (('entity', entity_type),))
+                time.sleep(0.5 * 2 ** attempt)
+        # The rows have no ids, so it cannot be checked whether the server stored them: retrying might add them twice
+        raise error_to_check
+
+    def _post_batch(self, entity_type, batch):
+        # Same request as molgenis_client.add_all, but the client expects a JSON error body, which proxies in front of
+        # the server (returning an HTML 502 or 503 page) do not send. Checking the status code ourselves turns every
+        # failed request into an HTTPError.
+        response = self.session.post(self.molgenis_client._url + 'v2/' + quote_plus(entity_type),
+                                     headers=self.molgenis_client._get_token_header_with_content_type(),
+                                     data=json.dumps({'entities': batch}))
+        response.raise_for_status()
+
+    def _get_unwritten_rows(self, entity_type, batch):
+        # Returns the rows of the batch that are not on the server, or None when that cannot be checked because some
+        # rows have no id (auto ids)
+        id_attr = self.get_meta(entity_type)['idAttribute']
+        ids = [str(row[id_attr]) for row in batch if row.get(id_attr) is not None]
+        if len(ids) < len(batch):
+            return None
+        query = '{}=in=({})'.format(id_attr, ','.join(ids))
+        existing = {str(row[id_attr]) for row in self.get_page(entity_type, q=query, attrs=id_attr, num=len(ids))[
+            'items']}
+        return [row for row in batch if str(row[id_attr]) not in existing]
+
+    @instrumented
+    def update_attribute_bulk(self, entity_type, ids, attribute, value, batch_size=1000, workers=None):
+        # Sets one attribute to the same value for all given ids. Instead of one update_one call per row, the rows are
+        # updated in batches of 1000 using the update attribute endpoint of the v2 API. Like in update_rows, <workers>
+        # is limited by the concurrency of the wrapper.
+        id_attr = self.get_meta(entity_type)['idAttribute']
+        rows = [{id_attr: entity_id, attribute: value} for entity_id in ids]
+        self._update_in_batches(entity_type + '/' + attribute, rows, batch_size, workers,
+                                lambda row: [(row[id_attr], attribute, value)])
+
+    @instrumented
+    def update_rows(self, entity_type, rows, batch_size=1000, workers=None):
+        # Updates complete rows (dictionaries like the ones used in add_values, including the id) in batches of 1000.
+        # Attributes that are not in the row will be emptied, just like when you update a row in the data explorer.
+        # The fallback for older servers (one update_one per attribute) empties them as well, so the result does not
+        # depend on the version of the server. The batches are sent by <workers> threads, which share the connections
+        # of the wrapper: more workers than its concurrency only wait for a connection.
+        meta = self.get_meta(entity_type)
+        id_attr = meta['idAttribute']
+        empty_values = self.get_empty_values(meta)
+        self._update_in_batches(entity_type, rows, batch_size, workers,
+                                lambda row: [(row[id_attr], attr, row.get(attr, empty_value)) for attr, empty_value in
+                                             empty_values.items() if attr != id_attr])
+
+    @classmethod
+    def get_empty_values(cls, meta):
+        # The attributes that can be written, with the value that empties them: an empty list for multiple references
+        # and None for the others. Compound attributes are replaced by their parts, computed attributes are skipped.
+        empty_values = OrderedDict()
+        for attribute in meta['attributes']:
+            if attribute['fieldType'] == 'COMPOUND':
+                empty_values.update(cls.get_empty_values(attribute))
+            elif not attribute.get('readOnly') and not attribute.get('auto'):
+                empty_values[attribute['name']] = [] if attribute['fieldType'] in (
+                    'MREF', 'CATEGORICAL_MREF', 'ONE_TO_MANY') else None
+        return empty_values
+
+    def _update_in_batches(self, path, rows, batch_size, workers, to_single_updates):
+        entity_type = path.split('/')[0]
+        workers = workers or self.concurrency
+        try:
+            self._put_in_batches(entity_type, path, rows, batch_size, workers, to_single_updates)
+        finally:
+            self.invalidate_cache(entity_type)
+
+    def _put_in_batches(self, entity_type, path, rows, batch_size, workers, to_single_updates):
+        url = self.molgenis_client._url + 'v2/' + path
+        headers = self.molgenis_client._get_token_header_with_content_type()
+        batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+        if not batches:
+            return
+
+        try:
+            response = self.session.put(url, headers=headers, data=json.dumps({'entities': batches[0]}))
+            response.raise_for_status()
+        except HTTPError as error:
+            # Older servers do not support the batch update, then fall back to updating the values one by one. Only
+            # the response to the first batch decides this: when a later batch fails (with a 404 or otherwise), the
+            # error is raised and the batches before it stay updated.
+            if error.response.status_code not in (404, 405):
+                raise
+            updates = [update for row in rows for update in to_single_updates(row)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda update: self.molgenis_client.update_one(entity_type, *update), updates))
+            return
+
+        def put_batch(batch):
+            batch_response = self.session.put(url, headers=headers, data=json.dumps({'entities': batch}))
+            batch_response.raise_for_status()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(put_batch, batches[1:]))
+
+    @staticmethod
+    def is_not_sent(error):
+        # True when the connection could not be made (a connect timeout or a refused connection), then the server
+        # certainly did not receive the request
+        if isinstance(error, ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def is_transient_error(error):
+        # Connection problems and 5xx responses might succeed when tried again, other errors (like a 400 because of
+        # an invalid value) will not. The client puts the status code at the start of the error message.
+        if isinstance(error, molgenis.MolgenisRequestError):
+            return error.message.startswith('5')
+        if isinstance(error, HTTPError) and error.response is not None:
+            return error.response.status_code >= 500
+        return True
 
     @staticmethod
     def generate_molgenis_date_from_datetime(datetime_element):
-        month0 = '0' + str(datetime_element.month)
-        month = month0[-2] + month0[-1]
-        day0 = '0' + str(datetime_element.day)
-        day = day0[-2] + day0[-1]
-        return '{}-{}-{}'.format(datetime_element.year, month, day)
+        # Dates are written as yyyy-mm-dd
+        return datetime_element.date().isoformat()
+
+
+class PatientGenerator:
+    # Generates random patients in large numbers. The names are drawn from the same lists (and with the same
+    # frequencies) as names.get_full_name does, but the lists are read once and the names, genders and birth dates
+    # of a whole batch of patients are drawn at once. Use a seed to get the same patients every time.
+    def __init__(self, seed=None, max_age=120):
+        self.random = random.Random(seed)
+        self.max_age = max_age
+        self.first_names = {'m': self._read_names(names.FILES['first:male']),
+                            'f': self._read_names(names.FILES['first:female'])}
+        self.last_names = self._read_names(names.FILES['last'])
+
+    @staticmethod
+    def _read_names(filename):
+        # Each line contains: name, frequency, cumulative frequency, rank
+        pool = []
+        cumulative_frequencies = []
+        with open(filename) as name_file:
+            for line in name_file:
+                name, _, cumulative, _ = line.split()
+                pool.append(name.capitalize())
+                cumulative_frequencies.append(float(cumulative))
+        return pool, cumulative_frequencies
+
+    def _draw_names(self, names_and_frequencies, number_of_names):
+        pool, cumulative_frequencies = names_and_frequencies
+        return self.random.choices(pool, cum_weights=cumulative_frequencies, k=number_of_names)
+
+    def generate(self, number_of_patients):
+        # Returns a list of patients (without id)
+        genders = self.random.choices(('m', 'f'), k=number_of_patients)
+        first_names = {gender: iter(self._draw_names(self.first_names[gender], genders.count(gender))) for gender in
+                       self.first_names}
+        last_names = self._draw_names(self.last_names, number_of_patients)
+
+        # Birth dates between max_age years ago and last year. By drawing a day number instead of a year and a day of
+        # the year, there is no need to handle the 366th day of years without a leap day.
+        this_year = datetime.date.today().year
+        first_day = datetime.date(this_year - self.max_age, 1, 1).toordinal()
+        last_day = datetime.date(this_year - 1, 12, 31).toordinal()
+        birth_dates = [datetime.date.fromordinal(self.random.randint(first_day, last_day)).isoformat() for _ in
+                       range(number_of_patients)]
+
+        return [{'firstName': next(first_names[gender]), 'lastName': last_name, 'birthdate': birth_date,
+                 'gender': gender} for gender, last_name, birth_date in zip(genders, last_names, birth_dates)]
+
+    def generate_chunks(self, number_of_patients, id_allocator, chunk_size=1000):
+        # Yields lists of at most <chunk_size> patients with new ids, ready to be uploaded with add_values(_bulk)
+        for start in range(0, number_of_patients, chunk_size):
+            patients = self.generate(min(chunk_size, number_of_patients - start))
+            for patient, patient_id in zip(patients, id_allocator.get_next_ids(len(patients))):
+                patient['id'] = patient_id
+            yield patients
+
+
+class IdAllocator:
+    # Hands out new ids for a table with ids like p000000001: a prefix followed by a number that is padded with zeros.
+    # The highest id in the table is requested once, after that the ids are generated without asking the server.
+    def __init__(self, molgenis_db, entity_type, prefix, width):
+        self.molgenis_db = molgenis_db
+        self.entity_type = entity_type
+        self.prefix = prefix
+        self.width = width
+        self._last_number = None
+        self._lock = threading.Lock()
+
+    @property
+    def last_id(self):
+        with self._lock:
+            return self._format(self._get_last_number())
+
+    def get_next_id(self):
+        return self.get_next_ids(1)[0]
+
+    def get_next_ids(self, number_of_ids):
+        # Reserves a block of ids at once
+        with self._lock:
+            first_number = self._get_last_number() + 1
+            self._last_number = first_number + number_of_ids - 1
+        return [self._format(number) for number in range(first_number, first_number + number_of_ids)]
+
+    def _format(self, number):
+        # Generate an id with <width> numbers, ending with the number, filling the rest with 0's
+        return '{}{}'.format(self.prefix, str(number).zfill(self.width))
+
+    def _get_last_number(self):
+        if self._last_number is None:
+            last_id = self._request_last_id()
+            self._last_number = int(last_id[len(self.prefix):]) if last_id else 0
+        return self._last_number
+
+    def _request_last_id(self):
+        # Let the server sort the ids and only return the highest one. When all ids are padded to the same length,
+        # sorting them as text gives the same result as sorting them by number.
+        id_attr = self.molgenis_db.get_meta(self.entity_type)['idAttribute']
+        highest = self.molgenis_db.get_page(self.entity_type, attrs=id_attr, sort_column=id_attr, sort_order='desc',
+                                            num=1)['items']
+        if not highest:
+            return None
+        last_id = highest[0][id_attr]
+        if self._is_padded(last_id):
+            return last_id
+
+        # Some ids are not padded (p12 is sorted after p000000100), so go through all ids (and only the ids) to find
+        # the highest one with our prefix
+        natural_key = natsort_keygen(key=lambda y: y.lower())
+        ids = (row[id_attr] for row in self.molgenis_db.iter_rows(self.entity_type, attributes=id_attr) if
+               row[id_attr].startswith(self.prefix) and row[id_attr][len(self.prefix):].isdigit())
+        return max(ids, key=natural_key, default=None)
+
+    def _is_padded(self, entity_id):
+        number = entity_id[len(self.prefix):]
+        return entity_id.startswith(self.prefix) and len(number) == self.width and number.isdigit()
 
 
 class HospitalSimulation:
-    def __init__(self, molgenis_db):
+    def __init__(self, molgenis_db, seed=None):
         self.molgenis_db = molgenis_db
-        self.last_patient_id = self.get_last_id('root_hospital_patients')
+        self.patient_ids = IdAllocator(molgenis_db, 'root_hospital_patients', prefix='p', width=9)
+        self.patient_generator = PatientGenerator(seed)
         self.new_patients = []
 
+    @property
+    def last_patient_id(self):
+        return self.patient_ids.last_id
+
     @staticmethod
     def get_number_of_visits():
         return random.randint(1, 20)
@@ -150,47 +1249,23 @@ class HospitalSimulation:
         return random.randint(0, total)
 
     def get_new_patients(self, total, existing):
-        new_patients = []
         number_of_new_patients = total - existing
-        for patient in range(number_of_new_patients):
-            new_patient = self.get_new_patient()
-            new_patients.append(new_patient)
-        return new_patients
+        if number_of_new_patients <= 0:
+            return []
+        return next(self.patient_generator.generate_chunks(number_of_new_patients, self.patient_ids,
+                                                           chunk_size=number_of_new_patients))
 
-    def get_last_id(self, table):
-        id_attr = self.molgenis_db.get_meta(table)['idAttribute']
-        ids = [row[id_attr] for row in self.molgenis_db.get_num(table, 10000)]
-        sorted_ids = natsorted(ids, key=lambda y: y.lower())
-        return sorted_ids[-1]
+    def register_random_patients(self, number_of_patients, chunk_size=1000):
+        # Generates and registers a large number of patients, without keeping all of them in memory
+        chunks = self.patient_generator.generate_chunks(number_of_patients, self.patient_ids, chunk_size)
+        return self.molgenis_db.add_values_bulk('root_hospital_patients', itertools.chain.from_iterable(chunks),
+                                                batch_size=chunk_size)
 
     def get_next_id(self):
-        id_number = int(self.last_patient_id[1::])
-        new_number = id_number + 1
-        # Generate a patient id with 9 numbers, ending with the new number, filling the rest with 0's
-        new_id = 'p{}{}'.format('0' * (9 - len(str(new_number))), new_number)
-        self.last_patient_id = new_id
-        return new_id
-
-    def get_random_date_of_birth(self):
-        # https://gist.github.com/knu2xs/8ca7e0a39bf26f736ef7
-        now = datetime.datetime.now()
-        # Get random year, max 120 years ago and at minimum last year
-        year = random.randint(now.year - 120, now.year - 1)
-        # try to get a date
-        try:
-            dob = datetime.datetime.strptime('{} {}'.format(random.randint(1, 366), year), '%j %Y')
-            return dob
-
-        # if the value happens to be in the leap year range, try again
-        except ValueError:
-            self.get_random_date_of_birth()
+        return self.patient_ids.get_next_id()
 
     def get_random_patient(self):
-        gender = 'male' if bool(random.getrandbits(1)) else 'female'
-        name = names.get_full_name(gender)
-        dob = self.molgenis_db.generate_molgenis_date_from_datetime(self.get_random_date_of_birth())
-        first_name, last_name = name.split(' ')
-        return {'firstName': first_name, 'lastName': last_name, 'birthdate': dob, 'gender': gender[0]}
+        return self.patient_generator.generate(1)[0]
 
     def get_new_patient(self):
         patient = self.get_random_patient()
@@ -198,22 +1273,33 @@ class HospitalSimulation:
         return patient
 
     def register_new_patients(self, patients):
-        self.molgenis_db.add_values('root_hospital_patients', patients)
+        # The bulk variant splits the patients in batches of 1000 for us
+        self.molgenis_db.add_values_bulk('root_hospital_patients', patients)
 
     @staticmethod
     def get_existing_patients(number_of_existing_patients, existing_patients):
         return [existing_patients[index] for index in range(number_of_existing_patients)]
 
-    def get_doctor_for_patient(self, patient_first_name, patient_last_name, doctors):
-        doctor = doctors[random.randint(0, len(doctors) - 1)]
-        # Patient cannot be treated by him or herself
+    @staticmethod
+    def get_doctor_for_patient(patient_first_name, patient_last_name, doctors, randomizer=random):
+        # Returns None when there is no doctor that can treat the patient
+        if not doctors:
+            return None
+        doctor = randomizer.choice(doctors)
+        # Patient cannot be treated by him or herself, only then we have to look at the other doctors
         if doctor['firstName'] == patient_first_name and doctor['lastName'] == patient_last_name:
-            self.get_doctor_for_patient(patient_first_name, patient_last_name, doctors)
-        else:
-            return doctor
+            other_doctors = [other for other in doctors if other is not doctor]
+            doctor = randomizer.choice(other_doctors) if other_doctors else None
+        return doctor
+
+    def get_doctors(self):
+        # Only retrieve the columns we use, with the labels of the functions and departments
+        return self.molgenis_db.get_with_query('root_hospital_employees', query='function_description==dc',
+                                               attributes='id,firstName,lastName',
+                                               expand={'function_description': 'label', 'department': 'label'})
 
     def get_doctors_description(self):
-        doctors = self.molgenis_db.get_with_query('root_hospital_employees', query='function_description==dc')
+        doctors = self.get_doctors()
         for doctor in doctors:
             cprint('\n{} {}'.format(doctor['firstName'], doctor['lastName']), 'magenta')
 
@@ -222,22 +1308,58 @@ class HospitalSimulation:
                 functions.append(function['label'])
             cprint(', '.join(functions), 'magenta')
 
-            department = None if not 'department' in doctor else doctor['department']['label']
+            department = None if not doctor.get('department') else doctor['department']['label']
             if department:
                 cprint('dept. {}'.format(department), 'magenta')
 
     def get_family_of_patient_by_name(self, first_name, last_name):
-        # Get the id of the patient by querying for the firstName and lastName
+        # Get the patient (with the ids of the children) by querying for the firstName and lastName
         patient_in_db = self.molgenis_db.get_with_query('root_hospital_patients',
                                                         'firstName=="{}";lastName=="{}"'.format(
-                                                            first_name, last_name))[0]
-        children_of_patient = [child['id'] for child in patient_in_db['children']]
-        spouse = self.molgenis_db.get_with_query('root_hospital_patients', '{};gender!={}'.format(
-            ';'.join(
-                ['children=={}'.format(child) for child in children_of_patient]),
-            patient_in_db['gender']['id']))[0]
-        complete_family = [patient_in_db['id'], spouse['id']] + children_of_patient
-        return complete_family
+                                                            first_name, last_name),
+                                                        attributes=self.family_attributes)[0]
+        return self.get_families_of_patients([patient_in_db])[patient_in_db['id']]
+
+    def get_families(self, patient_ids):
+        # Returns the family (patient, spouse and children) of each of the patients, as dictionary with the patient id
+        # as key. This takes one request per 100 patients and one request per 100 of their children.
+        patients = self.molgenis_db.resolve_references('root_hospital_patients', patient_ids,
+                                                       attributes=self.family_attributes)
+        return self.get_families_of_patients(patients.values())
+
+    def get_families_of_patients(self, patients):
+        # The spouse is the other parent of the children, so it is a patient of another gender that has all children
+        # of the patient as children as well. The parents of the children are retrieved with =in= queries of
+        # <family_batch_size> children, in parallel: one query for all children would not fit in the URL (servers like
+        # Tomcat refuse request lines longer than 8 KB).
+        children = sorted({child['id'] for patient in patients for child in patient['children']})
+        batches = [children[start:start + self.family_batch_size] for start in
+                   range(0, len(children), self.family_batch_size)]
+
+        def get_parents(batch):
+            return list(self.molgenis_db.iter_rows('root_hospital_patients',
+                                                   q='children=in=({})'.format(','.join(batch)),
+                                                   attributes=self.family_attributes))
+
+        with ThreadPoolExecutor(max_workers=self.molgenis_db.concurrency) as executor:
+            # A parent of children in several batches is returned more than once
+            parents = list(OrderedDict((parent['id'], parent) for batch_parents in executor.map(get_parents, batches)
+                                       for parent in batch_parents).values())
+
+        # The spouse is one of the parents of the first child, so only those have to be compared with the patient
+        parents_by_child = self.molgenis_db.build_index(parents, 'children')
+        families = {}
+        for patient in patients:
+            children_of_patient = [child['id'] for child in patient['children']]
+            candidates = parents_by_child.get(children_of_patient[0], []) if children_of_patient else []
+            spouses = [parent['id'] for parent in candidates if
+                       parent['id'] != patient['id'] and parent['gender']['id'] != patient['gender']['id'] and
+                       set(children_of_patient) <= {child['id'] for child in parent['children']}]
+            families[patient['id']] = [patient['id']] + spouses[:1] + children_of_patient
+        return families
+
+    family_attributes = 'id,gender(id),children(id)'
+    family_batch_size = 100
 
     def simulate_day(self):
         # Get current number of patients in the database.
@@ -248,7 +1370,7 @@ class HospitalSimulation:
         # Determine how many of the existing patients are visiting and how many are new
         number_existing_patients = self.get_number_of_existing_visits(number_visits)
         # Get existing patients
-        patients = self.molgenis_db.get('root_hospital_patients')
+        patients = self.molgenis_db.get('root_hospital_patients', attributes='id,firstName,lastName')
         existing_patients = self.get_existing_patients(number_existing_patients, patients)
         # Get the new patients
         new_patients = self.get_new_patients(number_visits, number_existing_patients)
@@ -258,11 +1380,15 @@ class HospitalSimulation:
         # merge existing and new patients
         patients_visiting = new_patients + existing_patients
         # assign doctor to each patient
-        doctors = self.molgenis_db.get_with_query('root_hospital_employees', query='function_description==dc')
+        doctors = self.get_doctors()
         for patient in patients_visiting:
             first_name = patient['firstName']
             last_name = patient['lastName']
             doctor = self.get_doctor_for_patient(first_name, last_name, doctors)
+            if doctor is None:
+                cprint('Patient: [{} {}] cannot be seen, there is no other doctor'.format(first_name, last_name),
+                       'magenta')
+                continue
             cprint('Patient: [{} {}] will by seen by [dr. {}]'.format(first_name, last_name, doctor['lastName']),
                    'magenta')
 
@@ -270,8 +1396,87 @@ class HospitalSimulation:
 
         cprint('Day has ended. Number of patients in database: {}'.format(patients_in_db), 'magenta')
 
+    def simulate_days(self, number_of_days, seed=None, verbose=False, batch_size=1000):
+        # Simulates many days at once. Unlike simulate_day, the patients and doctors are retrieved only once, all days
+        # are planned locally and the new patients are registered in batches at the end. Nothing is printed (unless
+        # verbose is True); the visits of each day are returned in the report instead.
+        started = time.time()
+        randomizer = random.Random(seed)
+        generator = PatientGenerator(seed) if seed is not None else self.patient_generator
+        patients_in_db = self.molgenis_db.get_total('root_hospital_patients')
+        known_patients = self.molgenis_db.get('root_hospital_patients', attributes='id,firstName,lastName')
+        doctors = self.get_doctors()
+
+        report = {'days': [], 'visits': 0, 'new_patients': 0, 'existing_patients': 0}
+        new_patients = []
+        for day in range(1, number_of_days + 1):
+            number_visits = randomizer.randint(1, 20)
+            number_existing_patients = min(randomizer.randint(0, number_visits), len(known_patients))
+            existing_patients = randomizer.sample(known_patients, number_existing_patients)
+            patients_today = generator.generate(number_visits - number_existing_patients)
+            for patient, patient_id in zip(patients_today, self.patient_ids.get_next_ids(len(patients_today))):
+                patient['id'] = patient_id
+            new_patients += patients_today
+            known_patients += patients_today
+            patients_in_db += len(patients_today)
+
+            # The doctor is None when no doctor can treat the patient
+            doctors_today = [self.get_doctor_for_patient(patient['firstName'], patient['lastName'], doctors, randomizer)
+                             for patient in patients_today + existing_patients]
+            visits = [(patient['id'], doctor['id'] if doctor else None) for patient, doctor in
+                      zip(patients_today + existing_patients, doctors_today)]
+            report['days'].append({'day': day, 'visits': visits, 'new_patients': len(patients_today),
+                                   'existing_patients': number_existing_patients, 'patients_in_db': patients_in_db})
+            report['visits'] += number_visits
+            report['new_patients'] += len(patients_today)
+            report['existing_patients'] += number_existing_patients
+
+        report['upload'] = self.molgenis_db.add_values_bulk('root_hospital_patients', new_patients,
+                                                            batch_size=batch_size)
+        report['seconds'] = time.time() - started
+
+        if verbose:
+            for day in report['days']:
+                cprint('Day {day}: {new_patients} new and {existing_patients} existing patients, '
+                       '{patients_in_db} patients in database'.format(**day), 'magenta')
+            cprint('{} days simulated in {:.1f} seconds: {} visits, {} new patients'.format(
+                number_of_days, report['seconds'], report['visits'], report['new_patients']), 'magenta')
+        return report
+
+
+def print_introduction():
+    cprint("""################################## MOLGENIS API CLIENT DEMONSTRATION ##################################
+# Before starting:
+# - Start molgenis version 8 or higher on http://localhost:8080, or configure an alternative URL with a Molgenis in the
+# tutorial below
+# - Use PyCharm to write your python code (shortcuts in this tutorial will be given for PyCharm exclusively)
+#
+# This tutorial is about two classes in this script:
+# - The MolgenisDatabase class will do all Molgenis related calls and is a sort of wrapper around the client to make it
+#   more understandable.
+# - The HospitalSimulation class contains the example we will use to explain the API client. It contains datamodel
+#   specific code and will also use other python libraries.
+# The other classes in this script are used by these two, you do not need them to follow the tutorial:
+# - BackoffWaitStrategy and FixedWaitStrategy decide how often to check whether an import is finished
+# - Metrics counts the requests and calls of the wrapper, TimedCache and QueryCache remember meta data and results
+# - PooledSession keeps the connections to Molgenis open, ArrowConverter turns rows into Arrow record batches
+# - PatientGenerator generates random patients, IdAllocator hands out the ids of new patients
+# Some features have their own module: emx.py (checking and splitting EMX files), local_mirror.py (a local copy of
+# tables in SQLite), async_molgenis_database.py (the wrapper for asyncio) and benchmark.py with
+# fake_molgenis_server.py (measuring the wrapper without Molgenis).
+#
+# To start with this tutorial scroll down to the main function. The steps of the tutorial will be described shortly.
+# After the description in comments, a few lines of code will follow. ctrl/cmd + click on the functions in the code
+# to see the actual code that is behind the function.
+#
+# Ctrl/cmd + ?/ key to uncomment lines (you may want to skip deleting and uploading data after doing it once).
+""", 'blue')
+    NextStep()
+
 
 def main():
+    print_introduction()
+
     cprint("# Before starting, configure the molgenis database wrapper.\n", 'blue')
 
     server = input("Configure API url (default=http://localhost:8080):\n")
@@ -349,6 +1554,16 @@ def main():
             number_of_patients = demo.get_total('root_hospital_patients')
         NextStep()
 
+    cprint("""
+    # Every simulated day takes a few requests. When you want to simulate a lot of days, it is faster to plan them
+    # all at once and register the new patients in bulk:\n""", 'blue')
+
+    print("\treport = simulation.simulate_days(30, verbose=True)")
+    execute = Execute().do_execute()
+    if execute:
+        simulation.simulate_days(30, verbose=True)
+        NextStep()
+
     cprint("\t# Now we filled up the database a bit, let's get a list of all patients;\n", 'blue')
 
     print("\tall_patients = demo.get('root_hospital_patients')")
@@ -398,6 +1613,24 @@ def main():
         cprint('\nNumber of patients (using paging): {}'.format(len(list_of_items)), 'magenta')
         NextStep()
 
+    cprint("""
+    # For really big tables, the pages can also be retrieved in parallel. The iter_rows function of the wrapper does
+    # this for you and gives you the rows one by one, without keeping the whole table in memory.\n""", 'blue')
+
+    print("""
+    number_of_patients = 0
+    for patient in demo.iter_rows('root_hospital_patients', page_size=100, concurrency=4):
+        number_of_patients += 1""")
+
+    execute = Execute().do_execute()
+    if execute:
+        number_of_patients = 0
+        for patient in demo.iter_rows('root_hospital_patients', page_size=100, concurrency=4):
+            number_of_patients += 1
+
+        cprint('\nNumber of patients (using iter_rows): {}'.format(number_of_patients), 'magenta')
+        NextStep()
+
     cprint("""
     # Now we covered:
     # Login
@@ -410,8 +1643,7 @@ def main():
     patient_to_change_first_name = 'Percy Ignatius'
     patient_to_change_last_name = 'Weasley'
     patients_to_update = simulation.get_family_of_patient_by_name(patient_to_change_first_name, patient_to_change_last_name)
-    for patient in patients_to_update:
-        demo.molgenis_client.update_one('root_hospital_patients', patient, 'residence', 'london')
+    demo.update_attribute_bulk('root_hospital_patients', patients_to_update, 'residence', 'london')
     """)
     execute = Execute().do_execute()
     if execute:
@@ -419,8 +1651,8 @@ def main():
         patient_to_change_last_name = 'Weasley'
         patients_to_update = simulation.get_family_of_patient_by_name(patient_to_change_first_name,
                                                                       patient_to_change_last_name)
-        for patient in patients_to_update:
-            demo.molgenis_client.update_one('root_hospital_patients', patient, 'residence', 'london')
+        # One request for the whole family, instead of one update_one call per family member
+        demo.update_attribute_bulk('root_hospital_patients', patients_to_update, 'residence', 'london')
 
         cprint("\t# Let's check if that worked:\n", 'blue')
         print("""
@@ -443,13 +1675,13 @@ def main():
 
     print("""
     patient_in_db = demo.get_with_query('root_hospital_employees', 'firstName=="Gregory";lastName=="House"')[0]['id']
-    demo.molgenis_client.delete_list('root_hospital_employees', [patient_in_db])""")
+    demo.delete_values('root_hospital_employees', [patient_in_db])""")
 
     execute = Execute().do_execute()
     if execute:
         employee_in_db = demo.get_with_query('root_hospital_employees', 'firstName=="Gregory";lastName=="House"')[0][
             'id']
-        demo.molgenis_client.delete_list('root_hospital_employees', [employee_in_db])
+        demo.delete_values('root_hospital_employees', [employee_in_db])
         print('simulation.get_doctors_description()')
         simulation.get_doctors_description()
         cprint("\t# He's gone!", 'blue')
@@ -468,10 +1700,16 @@ def main():
     #    of the get in combination with retrieving the total number of lines to get all your data.
     # 3) List comprehensions are faster than regular lines of code
     # 4) If you need to combine tables try to expand attributes rather than combining them in the code
-    # 5) If still you have to combine tables, use pandas
+    # 5) If still you have to combine tables, use demo.join (or pandas, demo.to_dataframe(table) retrieves a table as
+    #    DataFrame)
     # 6) Be aware that the client by default will return the data only, use the raw=True option to retrieve
     #    the metadata and total number of rows.
-    # 7) When you're using PyCharm, use the Python Console if you want to test things quickly""", 'green')
+    # 7) When you're using PyCharm, use the Python Console if you want to test things quickly
+    # 8) Only retrieve the attributes you need, for instance: demo.get(table, attributes='id,children(id)'). The
+    #    less data the server has to send, the faster your script will be.
+    # 9) Use print(demo.metrics.summary()) to see how many requests your script did and how long they took
+    # 10) Upload big EMX workbooks with demo.upload_data_in_chunks(file): the workbook is checked before it is
+    #     uploaded and imported in parts at the same time""", 'green')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,281 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from urllib.parse import quote_plus
+
+import aiohttp
+
+from Demo import MolgenisDatabase, BackoffWaitStrategy, TimedCache, QueryCache
+
+
+class AsyncMolgenisDatabase:
+    # The same wrapper as MolgenisDatabase, but for asyncio programs. All requests are done with aiohttp, at most
+    # <concurrency> at the same time, so you can start hundreds of requests with asyncio.gather without overloading the
+    # server.
+    # Usage:
+    # async with AsyncMolgenisDatabase('http://localhost:8080', 'admin') as demo:
+    #     patients, employees = await asyncio.gather(demo.get('root_hospital_patients'),
+    #                                                demo.get('root_hospital_employees'))
+    #     async for patient in demo.iter_rows('root_hospital_patients'):
+    #         print(patient['id'])
+    def __init__(self, molgenis_server, admin_password, concurrency=10, timeout=300, metadata_ttl=60.0,
+                 query_cache_ttl=60.0, query_cache_size=50 * 1024 * 1024):
+        self.molgenis_server = molgenis_server
+        self.api_url = molgenis_server + '/api/'
+        self._admin_password = admin_password
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.metadata_cache = TimedCache(metadata_ttl)
+        self.query_cache = QueryCache(query_cache_ttl, query_cache_size)
+        self.session = None
+        self._token = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.logout()
+
+    async def login(self):
+        # Keep connections open for reuse, with as many connections as requests that can run at the same time
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        response = await self._request('POST', 'v1/login', json_body={'username': 'admin',
+                                                                       'password': self._admin_password})
+        self._token = response['token']
+
+    async def logout(self):
+        try:
+            await self._request('POST', 'v1/logout')
+        finally:
+            self._token = None
+            await self.session.close()
+
+    async def _request(self, method, path, params=None, json_body=None, data=None, url=None):
+        headers = {'x-molgenis-token': self._token} if self._token else {}
+        if json_body is not None:
+            data = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        async with self._semaphore:
+            async with self.session.request(method, url or self.api_url + path, params=params, data=data,
+                                            headers=headers) as response:
+                response.raise_for_status()
+                content = await response.read()
+        return json.loads(content.decode('utf-8')) if content and response.content_type == 'application/json' \
+            else content.decode('utf-8')
+
+    async def upload_data(self, file_to_upload, wait_strategy=None):
+        # Uploads a file with the import wizard and waits for the import to finish, other coroutines keep running
+        form = aiohttp.FormData()
+        with open(os.path.abspath(file_to_upload), 'rb') as zip_file:
+            form.add_field('file', zip_file, filename=os.path.basename(file_to_upload))
+            response = await self._request('POST', None, data=form,
+                                           url=self.molgenis_server + '/plugin/importwizard/importFile')
+        try:
+            return await self.check_status(response, wait_strategy)
+        finally:
+            self.invalidate_cache()
+
+    async def check_status(self, url, wait_strategy=None):
+        # Returns the sys_ImportRun row of the import when it is no longer running
+        entity_id = url.split('/')[-1]
+        path = 'v2/sys_ImportRun/' + quote_plus(entity_id)
+        import_run = await self._request('GET', path)
+        if wait_strategy is None:
+            wait_strategy = BackoffWaitStrategy()
+
+        for interval in wait_strategy.intervals():
+            if import_run['status'] != 'RUNNING':
+                break
+            await asyncio.sleep(interval)
+            import_run = await self._request('GET', path)
+
+        if import_run['status'] == 'RUNNING':
+            raise TimeoutError('Import {} still running after {} seconds'.format(entity_id, wait_strategy.timeout))
+        return import_run
+
+    async def get_page(self, entity_type, q=None, attrs=None, sort_column=None, sort_order=None, num=100, start=0):
+        params = {'num': num, 'start': start}
+        if q:
+            params['q'] = q
+        if attrs:
+            params['attrs'] = attrs
+        if sort_column:
+            params['sort'] = sort_column + (':' + sort_order if sort_order else '')
+        return await self._request('GET', 'v2/' + quote_plus(entity_type), params=params)
+
+    async def get_total(self, entity_type, q=None):
+        total = self.metadata_cache.get((entity_type, 'total', q))
+        if total is None:
+            total = (await self._get_without_rows(entity_type, q))['total']
+        return total
+
+    async def get_meta(self, entity_type, attributes=None, expand=None):
+        attrs = MolgenisDatabase.build_attrs(attributes, expand)
+        meta = self.metadata_cache.get((entity_type, 'meta', attrs))
+        if meta is None:
+            meta = (await self._get_without_rows(entity_type, attrs=attrs))['meta']
+        return meta
+
+    async def _get_without_rows(self, entity_type, q=None, attrs=None):
+        response = await self.get_page(entity_type, q=q, attrs=attrs, num=0)
+        self.metadata_cache.put((entity_type, 'meta', attrs), response['meta'])
+        self.metadata_cache.put((entity_type, 'total', q), response['total'])
+        return response
+
+    async def get_with_query(self, entity_type, query, attributes=None, expand=None):
+        return await self.cached_get(entity_type, q=query, attributes=attributes, expand=expand)
+
+    async def get(self, entity_type, attributes=None, expand=None):
+        return await self.cached_get(entity_type, attributes=attributes, expand=expand)
+
+    async def get_num(self, entity_type, num, attributes=None, expand=None):
+        return await self.cached_get(entity_type, num=num, attributes=attributes, expand=expand)
+
+    async def cached_get(self, entity_type, q=None, attributes=None, expand=None, sort_column=None, sort_order=None,
+                         num=100, start=0):
+        attrs = MolgenisDatabase.build_attrs(attributes, expand)
+        key = (entity_type, q, attrs, sort_column, sort_order, num, start)
+        data = self.query_cache.get(key)
+        if data is None:
+            data = (await self.get_page(entity_type, q=q, attrs=attrs, sort_column=sort_column,
+                                        sort_order=sort_order, num=num, start=start))['items']
+            self.query_cache.put(key, data)
+        return list(data)
+
+    async def iter_rows(self, entity_type, q=None, attributes=None, expand=None, page_size=10000, pages_ahead=None):
+        # Async generator over all rows, see MolgenisDatabase.iter_rows. At most <pages_ahead> pages are requested
+        # before the rows of the oldest page have been consumed.
+        pages_ahead = pages_ahead or self.concurrency
+        attrs = MolgenisDatabase.build_attrs(attributes, expand)
+        first_page = await self.get_page(entity_type, q=q, attrs=attrs, num=page_size)
+        for row in first_page['items']:
+            yield row
+
+        pages_in_flight = []
+        try:
+            for start in range(page_size, first_page['total'], page_size):
+                pages_in_flight.append(asyncio.ensure_future(
+                    self.get_page(entity_type, q=q, attrs=attrs, num=page_size, start=start)))
+                if len(pages_in_flight) >= pages_ahead:
+                    for row in (await pages_in_flight.pop(0))['items']:
+                        yield row
+            while pages_in_flight:
+                for row in (await pages_in_flight.pop(0))['items']:
+                    yield row
+        finally:
+            for page in pages_in_flight:
+                page.cancel()
+
+    def invalidate_cache(self, entity_type=None, package=None):
+        self.metadata_cache.invalidate(entity_type, package)
+        self.query_cache.invalidate(entity_type, package)
+
+    async def delete_package(self, package):
+        try:
+            await self._request('DELETE', 'v1/sys_md_Package/' + quote_plus(package))
+        finally:
+            self.invalidate_cache(package=package)
+
+    async def delete_values(self, entity_type, ids):
+        try:
+            await self._request('DELETE', 'v2/' + quote_plus(entity_type), json_body={'entityIds': ids})
+        finally:
+            self.invalidate_cache(entity_type)
+
+    async def add_values(self, entity_type, values):
+        # Max number of values per call = 1000, see MolgenisDatabase.add_values for the format of the values
+        try:
+            response = await self._request('POST', 'v2/' + quote_plus(entity_type), json_body={'entities': values})
+        finally:
+            self.invalidate_cache(entity_type)
+        return [resource['href'].split('/')[-1] for resource in response['resources']]
+
+    async def add_values_bulk(self, entity_type, values, batch_size=1000, retries=3, workers=None):
+        # Splits the values in batches of 1000 that are added by <workers> tasks at the same time (by default the
+        # concurrency of the wrapper). A task only reads the next batch from the values when its previous batch is
+        # done, so like in MolgenisDatabase.add_values_bulk a generator is never read much further than the batches
+        # that are being sent. Returns the same summary as MolgenisDatabase.add_values_bulk.
+        workers = workers or self.concurrency
+        summary = {'rows_written': 0, 'batches': 0, 'failed_batches': [], 'rows_per_second': 0.0}
+        started = time.time()
+        values = iter(values)
+        batch_ids = itertools.count()
+
+        async def add_batches():
+            while True:
+                batch = list(itertools.islice(values, batch_size))
+                if not batch:
+                    return
+                batch_id = next(batch_ids)
+                summary['batches'] += 1
+                try:
+                    # Await before adding: summary['rows_written'] += await ... would add to the number from before the
+                    # await and lose the rows the other tasks wrote in the meantime
+                    rows_written = await self._add_batch_with_retries(entity_type, batch, retries)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    summary['failed_batches'].append(batch_id)
+                else:
+                    summary['rows_written'] += rows_written
+
+        try:
+            await asyncio.gather(*[add_batches() for _ in range(workers)])
+        finally:
+            self.invalidate_cache(entity_type)
+        summary['failed_batches'].sort()
+        duration = time.time() - started
+        if duration > 0:
+            summary['rows_per_second'] = summary['rows_written'] / duration
+        return summary
+
+    async def _add_batch_with_retries(self, entity_type, batch, retries):
+        # Same retries as MolgenisDatabase._add_batch_with_retries: after a failure the server might have processed,
+        # the next attempt first looks up which rows exist and only posts the others
+        number_of_rows = len(batch)
+        error_to_check = None
+        for attempt in range(retries + 1):
+            try:
+                if error_to_check is not None:
+                    unwritten_rows = await self._get_unwritten_rows(entity_type, batch)
+                    if unwritten_rows is None:
+                        break
+                    batch, error_to_check = unwritten_rows, None
+                    if not batch:
+                        return number_of_rows
+                await self._request('POST', 'v2/' + quote_plus(entity_type), json_body={'entities': batch})
+                return number_of_rows
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt == retries or not self.is_transient_error(error):
+                    raise
+                if error_to_check is None and not self.is_not_sent(error):
+                    error_to_check = error
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        # The rows have no ids, so it cannot be checked whether the server stored them: retrying might add them twice
+        raise error_to_check
+
+    async def _get_unwritten_rows(self, entity_type, batch):
+        # Returns the rows of the batch that are not on the server, or None when some rows have no id
+        id_attr = (await self.get_meta(entity_type))['idAttribute']
+        ids = [str(row[id_attr]) for row in batch if row.get(id_attr) is not None]
+        if len(ids) < len(batch):
+            return None
+        query = '{}=in=({})'.format(id_attr, ','.join(ids))
+        existing = {str(row[id_attr]) for row in (await self.get_page(entity_type, q=query, attrs=id_attr,
+                                                                      num=len(ids)))['items']}
+        return [row for row in batch if str(row[id_attr]) not in existing]
+
+    @staticmethod
+    def is_not_sent(error):
+        # True when the connection could not be made, then the server certainly did not receive the request
+        return isinstance(error, aiohttp.ClientConnectorError)
+
+    @staticmethod
+    def is_transient_error(error):
+        # Only server errors, timeouts and connection problems might succeed when tried again
+        status = getattr(error, 'status', None)
+        return status is None or status >= 500
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import time
+
+from Demo import MolgenisDatabase, HospitalSimulation, PatientGenerator
+from emx import EmxWorkbook
+from fake_molgenis_server import FakeMolgenisServer
+
+example_data = 'very_advanced_data_example.xlsx'
+
+
+def generate_patients(number_of_patients, first_number=1, residence=None):
+    # residence: the id of a row of root_cities, or None
+    return [{'id': 'p{:09d}'.format(number), 'firstName': 'Patient', 'lastName': str(number), 'residence': residence}
+            for number in range(first_number, first_number + number_of_patients)]
+
+
+def seed_hospital(server, number_of_patients, seed=None):
+    # Imports the example workbook directly into the fake server and adds generated patients until the patients
+    # table has <number_of_patients> rows. Every four generated patients are a family: two parents and two children.
+    server.import_emx(example_data)
+    existing_ids = list(server.get_table('root_hospital_patients'))
+    last_number = max(int(patient_id[1:]) for patient_id in existing_ids if patient_id[1:].isdigit())
+    randomizer = random.Random(seed)
+    cities = list(server.get_table('root_cities'))
+    diagnoses = list(server.get_table('root_hospital_diagnosis'))
+
+    patients = PatientGenerator(seed).generate(max(0, number_of_patients - len(existing_ids)))
+    for number, patient in enumerate(patients, start=last_number + 1):
+        patient.update(id='p{:09d}'.format(number), residence=randomizer.choice(cities),
+                       birthplace=randomizer.choice(cities), diagnosis=randomizer.sample(diagnoses, 2), children=[])
+    for family in range(0, len(patients) - 3, 4):
+        father, mother, first_child, second_child = patients[family:family + 4]
+        father['gender'], mother['gender'] = 'm', 'f'
+        father['children'] = mother['children'] = [first_child['id'], second_child['id']]
+    server.add_rows('root_hospital_patients', patients)
+
+
+@contextlib.contextmanager
+def quiet():
+    # The demo prints what it does (and shows spinners), which is not what we want to measure
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(name, server, function, demo=None, rows=None, scale=None):
+    # Runs the function once and reports its duration, the number of requests the server received, the number of
+    # rows per second and the mean duration of a request (as measured by the wrapper)
+    server.reset_request_log()
+    if demo is not None:
+        demo.invalidate_cache()
+        demo.metrics.reset()
+    started = time.perf_counter()
+    with quiet():
+        function()
+    duration = time.perf_counter() - started
+
+    result = {'scale': scale, 'operation': name, 'seconds': duration, 'requests': server.count_requests(),
+              'rows': rows, 'rows_per_second': rows / duration if rows and duration else None,
+              'ms_per_request': None}
+    if demo is not None and demo.metrics.count('molgenis_request_seconds'):
+        result['ms_per_request'] = 1000 * demo.metrics.seconds('molgenis_request_seconds') / demo.metrics.count(
+            'molgenis_request_seconds')
+    print('{:<36} {:>9.3f}s {:>9} {:>9} {:>12} {:>10}'.format(
+        name, duration, result['requests'], rows if rows is not None else '',
+        '{:.0f}'.format(result['rows_per_second']) if result['rows_per_second'] else '',
+        '{:.2f}'.format(result['ms_per_request']) if result['ms_per_request'] is not None else ''))
+    return result
+
+
+def print_header(title):
+    print('\n# {}'.format(title))
+    print('{:<36} {:>10} {:>9} {:>9} {:>12} {:>10}'.format('operation', 'seconds', 'requests', 'rows', 'rows/s',
+                                                          'ms/request'))
+
+
+def check_iter_rows(number_of_rows=25000, page_sizes=(1000, 3000, 10000)):
+    # Checks that iter_rows returns every row once, in the order of the server, with one request per page, also for
+    # tables of more than 10000 rows (the maximum of a single get) and page sizes that do not divide the total
+    print('\n# Checking iter_rows with {} rows'.format(number_of_rows))
+    with FakeMolgenisServer() as server:
+        server.add_table('test_rows', [{'id': 'row{:06d}'.format(number), 'number': number}
+                                       for number in range(number_of_rows)])
+        expected = [row['id'] for row in server.get_rows('test_rows')]
+        demo = MolgenisDatabase(server.url, 'admin')
+        single_fetch = [row['id'] for row in demo.get_num('test_rows', 10000)]
+        if single_fetch != expected[:10000]:
+            raise AssertionError('get_num does not return the rows in the order of the server')
+        for page_size in page_sizes:
+            server.reset_request_log()
+            ids = [row['id'] for row in demo.iter_rows('test_rows', page_size=page_size)]
+            if ids != expected:
+                raise AssertionError('iter_rows with pages of {} returned {} rows in a different order'.format(
+                    page_size, len(ids)))
+            if server.count_requests() != math.ceil(number_of_rows / page_size):
+                raise AssertionError('iter_rows with pages of {} took {} requests instead of {}'.format(
+                    page_size, server.count_requests(), math.ceil(number_of_rows / page_size)))
+            print('iter_rows with pages of {}: {} rows in {} requests'.format(page_size, len(ids),
+                                                                             server.count_requests()))
+
+
+def benchmark_import(latency, import_seconds):
+    # Uploads the example workbook with the import wizard and waits for the sys_ImportRun to finish
+    print_header('Importing {} (latency {}s, import takes {}s)'.format(example_data, latency, import_seconds))
+    with FakeMolgenisServer(latency=latency, import_seconds=import_seconds) as server:
+        demo = MolgenisDatabase(server.url, 'admin')
+        with EmxWorkbook(example_data) as workbook:
+            rows = sum(1 for sheet in workbook.data_sheets for _ in workbook.iter_rows(sheet))
+        return [measure('upload_data', server, lambda: demo.upload_data(example_data), demo, rows),
+                measure('delete_package', server, lambda: demo.delete_package('root'), demo),
+                measure('validate_emx', server, lambda: demo.validate_emx(example_data), demo, rows),
+                measure('upload_data_in_chunks (25 rows)', server,
+                        lambda: demo.upload_data_in_chunks(example_data, chunk_size=25), demo, rows)]
+
+
+def benchmark_hospital(number_of_patients, number_of_rows, number_of_days, latency, seed=1):
+    # Measures the wrapper operations against a hospital of <number_of_patients> patients
+    print_header('Hospital with {} patients, {} rows per write (latency {}s)'.format(number_of_patients,
+                                                                                   number_of_rows, latency))
+    results = []
+    with FakeMolgenisServer(latency=latency) as server:
+        seed_hospital(server, number_of_patients, seed)
+        demo = MolgenisDatabase(server.url, 'admin')
+        patients = 'root_hospital_patients'
+        total = len(server.get_table(patients))
+
+        def run(name, function, rows=None):
+            results.append(measure(name, server, function, demo, rows, number_of_patients))
+
+        run('get (100 rows)', lambda: demo.get(patients), 100)
+        run('get_num (10000 rows)', lambda: demo.get_num(patients, 10000), min(total, 10000))
+        run('get_with_query', lambda: demo.get_with_query(patients, 'gender==f'))
+        run('get with expanded references', lambda: demo.get(patients, expand={'diagnosis': '*', 'residence': '*'}),
+            100)
+        run('iter_rows (pages of 10000)', lambda: sum(1 for _ in demo.iter_rows(patients)), total)
+        run('iter_rows (pages of 1000)', lambda: sum(1 for _ in demo.iter_rows(patients, page_size=1000)), total)
+        run('iter_rows (only id)', lambda: sum(1 for _ in demo.iter_rows(patients, attributes='id')), total)
+
+        # The residences have to exist, like on a real server
+        cities = list(server.get_table('root_cities'))
+        new_patients = generate_patients(number_of_rows, first_number=10 ** 8, residence=cities[0])
+        batches = [new_patients[start:start + 1000] for start in range(0, len(new_patients), 1000)]
+        run('add_values (batches of 1000)', lambda: [demo.add_values(patients, batch) for batch in batches],
+            number_of_rows)
+        ids = [patient['id'] for patient in new_patients]
+        run('delete_values (delete_list)', lambda: demo.delete_values(patients, ids), number_of_rows)
+        run('add_values_bulk', lambda: demo.add_values_bulk(patients, new_patients), number_of_rows)
+
+        run('update_one per row', lambda: [demo.molgenis_client.update_one(patients, patient, 'residence', cities[1])
+                                           for patient in ids], number_of_rows)
+        run('update_attribute_bulk', lambda: demo.update_attribute_bulk(patients, ids, 'residence', cities[2]),
+            number_of_rows)
+        run('update_rows', lambda: demo.update_rows(patients, [dict(row, residence=cities[3])
+                                                               for row in new_patients]), number_of_rows)
+        run('delete_values (delete_list) again', lambda: demo.delete_values(patients, ids), number_of_rows)
+
+        families = [patient_id for patient_id, patient in server.get_table(patients).items() if patient['children']]
+        simulation = HospitalSimulation(demo, seed)
+        random.seed(seed)
+        run('simulate_day x {}'.format(number_of_days),
+            lambda: [simulation.simulate_day() for _ in range(number_of_days)])
+        run('simulate_days({})'.format(number_of_days), lambda: simulation.simulate_days(number_of_days, seed))
+        run('get_families (100 patients)', lambda: simulation.get_families(families[:100]), 100)
+    return results
+
+
+def benchmark_async(number_of_patients, number_of_rows, latency, seed=1):
+    # Measures the asyncio wrapper (needs aiohttp) against the same hospital as benchmark_hospital
+    from async_molgenis_database import AsyncMolgenisDatabase
+    print_header('AsyncMolgenisDatabase, hospital with {} patients, {} rows per write (latency {}s)'.format(
+        number_of_patients, number_of_rows, latency))
+    results = []
+    loop = asyncio.new_event_loop()
+    with FakeMolgenisServer(latency=latency) as server:
+        seed_hospital(server, number_of_patients, seed)
+        demo = AsyncMolgenisDatabase(server.url, 'admin')
+        loop.run_until_complete(demo.login())
+        patients = 'root_hospital_patients'
+        total = len(server.get_table(patients))
+
+        def run(name, coroutine_function, rows=None):
+            demo.invalidate_cache()
+            results.append(measure('async ' + name, server, lambda: loop.run_until_complete(coroutine_function()),
+                                   rows=rows, scale=number_of_patients))
+
+        async def count_rows(page_size=10000):
+            number_of_rows_read = 0
+            async for _ in demo.iter_rows(patients, page_size=page_size):
+                number_of_rows_read += 1
+            if number_of_rows_read != total:
+                raise AssertionError('iter_rows returned {} of {} rows'.format(number_of_rows_read, total))
+
+        new_patients = generate_patients(number_of_rows, first_number=10 ** 8,
+                                         residence=next(iter(server.get_table('root_cities'))))
+
+        async def add_values_bulk():
+            # A generator, to make sure the values do not have to be in memory
+            summary = await demo.add_values_bulk(patients, (patient for patient in new_patients))
+            if summary['rows_written'] != number_of_rows or summary['failed_batches']:
+                raise AssertionError('add_values_bulk failed: {}'.format(summary))
+
+        try:
+            run('get_total', lambda: demo.get_total(patients))
+            run('get (100 rows)', lambda: demo.get(patients), 100)
+            run('get_with_query', lambda: demo.get_with_query(patients, 'gender==f'))
+            run('iter_rows (pages of 10000)', count_rows, total)
+            run('iter_rows (pages of 1000)', lambda: count_rows(page_size=1000), total)
+            run('add_values_bulk', add_values_bulk, number_of_rows)
+            run('delete_values', lambda: demo.delete_values(patients, [patient['id'] for patient in new_patients]),
+                number_of_rows)
+        finally:
+            loop.run_until_complete(demo.logout())
+            loop.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns the operations that need more requests than in the baseline, or take more than <tolerance> times as long
+    previous = {(result['scale'], result['operation']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scale'], result['operation']))
+        if before is None:
+            continue
+        if result['requests'] > before['requests'] or result['seconds'] > before['seconds'] * tolerance:
+            regressions.append((result, before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the MolgenisDatabase wrapper against a fake MOLGENIS')
+    parser.add_argument('--patients', type=int, nargs='+', default=[1000, 10000],
+                        help='number(s) of patients in the hospital (default=1000 10000)')
+    parser.add_argument('--rows', type=int, default=2000,
+                        help='number of rows to add, update and delete (default=2000)')
+    parser.add_argument('--days', type=int, default=30, help='number of days to simulate (default=30)')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds of latency for every request (default=0.002)')
+    parser.add_argument('--import-seconds', type=float, default=0.5,
+                        help='seconds an import of the example data takes on the server (default=0.5)')
+    parser.add_argument('--no-async', action='store_true', help='do not benchmark the asyncio wrapper')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with an earlier --output file')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='how many times slower than the baseline an operation may be (default=1.5)')
+    arguments = parser.parse_args()
+
+    check_iter_rows()
+    results = benchmark_import(arguments.latency, arguments.import_seconds)
+    for number_of_patients in arguments.patients:
+        results += benchmark_hospital(number_of_patients, arguments.rows, arguments.days, arguments.latency)
+        if not arguments.no_async:
+            results += benchmark_async(number_of_patients, arguments.rows, arguments.latency)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), arguments.tolerance)
+        for result, before in regressions:
+            print('Regression in {} ({} patients): {:.3f}s and {} requests, was {:.3f}s and {} requests'.format(
+                result['operation'], result['scale'], result['seconds'], result['requests'], before['seconds'],
+                before['requests']))
+        if regressions:
+            sys.exit(1)
+        print('\nNo regressions compared to {}'.format(arguments.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+import datetime
+import itertools
+import os
+from collections import OrderedDict
+
+import openpyxl
+
+
+class EmxValidationError(ValueError):
+    # Raised when an EMX workbook has problems that would make the import fail, errors contains all problems found
+    def __init__(self, errors):
+        super().__init__('{} problem(s) found in the EMX workbook: {}'.format(len(errors), '; '.join(errors[:5])))
+        self.errors = errors
+
+
+class EmxWorkbook:
+    # Reads an EMX workbook (the Excel format of the MOLGENIS import wizard) row by row: openpyxl opens the workbook
+    # in read only mode, so even workbooks of hundreds of MB do not have to fit in memory. The packages, entities and
+    # attributes sheets describe the data model, every other sheet contains the rows of the entity type with the same
+    # (full) name. Needs openpyxl (pip3 install -e .[emx]).
+    # Usage:
+    # with EmxWorkbook('very_advanced_data_example.xlsx') as workbook:
+    #     for patient in workbook.iter_entities('root_hospital_patients'):
+    #         print(patient['id'], patient['children'])
+    meta_sheets = ('packages', 'entities', 'attributes', 'tags', 'i18nstrings', 'languages')
+    data_types = ('string', 'text', 'int', 'long', 'decimal', 'bool', 'date', 'datetime', 'xref', 'mref',
+                  'categorical', 'categorical_mref', 'one_to_many', 'enum', 'email', 'hyperlink', 'html', 'script',
+                  'compound', 'file')
+    reference_types = ('xref', 'categorical', 'file')
+    multiple_reference_types = ('mref', 'categorical_mref', 'one_to_many')
+    # The data types of EMX are lower case, the field types in the meta data of the REST API are upper case
+    default_data_type = 'string'
+
+    def __init__(self, path):
+        self.path = path
+        self.workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        self.packages = OrderedDict((package['name'], package) for package in self.iter_rows('packages'))
+        self.entities = OrderedDict()
+        for entity in self.iter_rows('entities'):
+            entity_type = '{}_{}'.format(entity['package'], entity['name']) if entity.get('package') else \
+                entity['name']
+            self.entities[entity_type] = dict(entity, fullName=entity_type)
+        self.attributes = OrderedDict((entity_type, []) for entity_type in self.entities)
+        for attribute in self.iter_rows('attributes'):
+            attribute['name'] = str(attribute['name']).strip()
+            attribute['dataType'] = (attribute.get('dataType') or self.default_data_type).lower()
+            self.attributes.setdefault(attribute['entity'], []).append(attribute)
+
+    def close(self):
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def data_sheets(self):
+        return [name for name in self.workbook.sheetnames if name not in self.meta_sheets]
+
+    def is_abstract(self, entity_type):
+        return self.is_true(self.entities.get(entity_type, {}).get('abstract'))
+
+    def get_attributes(self, entity_type):
+        # The attributes of the entity type, starting with the attributes it inherits from the entity it extends
+        extends = self.entities.get(entity_type, {}).get('extends')
+        inherited = self.get_attributes(extends) if extends else []
+        return inherited + self.attributes.get(entity_type, [])
+
+    def get_id_attribute(self, entity_type):
+        for attribute in self.get_attributes(entity_type):
+            if attribute.get('idAttribute') == 'AUTO' or self.is_true(attribute.get('idAttribute')):
+                return attribute['name']
+        return None
+
+    def is_auto_id(self, entity_type):
+        # With idAttribute AUTO the server generates the ids, so the data sheet does not need to have an id column
+        return any(attribute.get('idAttribute') == 'AUTO' for attribute in self.get_attributes(entity_type))
+
+    def get_label_attribute(self, entity_type):
+        for attribute in self.get_attributes(entity_type):
+            if self.is_true(attribute.get('labelAttribute')):
+                return attribute['name']
+        return self.get_id_attribute(entity_type)
+
+    def get_external_entity_types(self):
+        # The entity types the workbook refers to (or has data for) without defining them, they should exist already
+        names = {entity.get('extends') for entity in self.entities.values()} | set(self.attributes) | set(
+            self.data_sheets) | {attribute.get('refEntity') for attributes in self.attributes.values() for attribute
+                                 in attributes}
+        return sorted(name for name in names if name and name not in self.entities)
+
+    def get_columns(self, sheet_name):
+        header = next(self.workbook[sheet_name].iter_rows(values_only=True, max_row=1), ())
+        return [str(name).strip() for name in header if name is not None and str(name).strip()]
+
+    def iter_rows(self, sheet_name):
+        # Yields the rows of a sheet as they are in the workbook, as dictionaries with the (stripped) column headers as
+        # keys. Empty rows and columns without header are skipped.
+        for _, row in self.iter_numbered_rows(sheet_name):
+            yield row
+
+    def iter_numbered_rows(self, sheet_name):
+        # Same as iter_rows, but yields the row numbers (like Excel shows them) with the rows
+        if sheet_name not in self.workbook.sheetnames:
+            return
+        rows = self.workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [(index, str(name).strip()) for index, name in enumerate(header) if
+                   name is not None and str(name).strip()]
+        for row_number, values in enumerate(rows, start=2):
+            row = {name: values[index] if index < len(values) else None for index, name in columns}
+            if not all(self.is_empty(value) for value in row.values()):
+                yield row_number, row
+
+    def iter_entities(self, entity_type, data_types=None):
+        # Yields the rows of an entity type in the format of the REST API: typed values, references as ids and
+        # multiple references as lists of ids. For entity types that are not defined in the workbook, the data types
+        # of the attributes can be given as dictionary.
+        if data_types is None:
+            data_types = {attribute['name']: attribute['dataType'] for attribute in self.get_attributes(entity_type)}
+        for row in self.iter_rows(entity_type):
+            yield {name: self.convert_value(data_types.get(name, self.default_data_type), value) for name, value in
+                   row.items() if data_types.get(name) != 'compound'}
+
+    @classmethod
+    def convert_value(cls, data_type, value):
+        if data_type in cls.multiple_reference_types:
+            if cls.is_empty(value):
+                return []
+            return [part.strip() for part in cls.to_text(value).split(',') if part.strip()]
+        if cls.is_empty(value):
+            return None
+        if data_type in ('int', 'long'):
+            return int(value)
+        if data_type == 'decimal':
+            return float(value)
+        if data_type == 'bool':
+            return value if isinstance(value, bool) else cls.is_true(value)
+        if data_type == 'date' and isinstance(value, datetime.datetime):
+            return value.date().isoformat()
+        if data_type in ('date', 'date_time', 'datetime') and isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return cls.to_text(value)
+
+    @staticmethod
+    def to_text(value):
+        # Excel stores ids like 10 and telephone numbers as numbers, MOLGENIS reads them as (trimmed) text
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
+
+    @staticmethod
+    def is_empty(value):
+        return value is None or isinstance(value, str) and not value.strip()
+
+    @staticmethod
+    def is_true(value):
+        return value is True or str(value).strip().lower() == 'true'
+
+    def validate(self, known_entity_types=(), max_errors=100):
+        # Checks the workbook before it is uploaded, returns a list with (at most <max_errors>) problems the import
+        # would fail on. See iter_problems for what is checked.
+        return list(itertools.islice(self.iter_problems(known_entity_types), max_errors))
+
+    def iter_problems(self, known_entity_types=()):
+        # Checks the data model (entity types, attributes, references and id attributes) and the data (ids, required
+        # values, types, enum options and references to rows in the workbook). The rows of entity types that are not
+        # in the workbook can only be checked by the server; <known_entity_types> are the entity types that exist there.
+        # The data sheets are read twice: once to collect the ids, once to check the values. The ids of entity types
+        # with an AUTO id attribute are generated by the server, so these ids and the references to them are not
+        # checked.
+        known = set(self.entities) | set(known_entity_types)
+        for problem in self._iter_model_problems(known):
+            yield problem
+
+        ids = {entity_type: None if self.is_auto_id(entity_type) else set() for entity_type in self.entities}
+        checked_sheets = []
+        for sheet in self.data_sheets:
+            if sheet not in known:
+                yield 'Sheet {} does not belong to a known entity type'.format(sheet)
+            elif self.is_abstract(sheet):
+                yield 'Sheet {} contains rows of abstract entity type {}'.format(sheet, sheet)
+            elif sheet in self.entities and self.is_auto_id(sheet):
+                checked_sheets.append(sheet)
+            elif sheet in self.entities and self.get_id_attribute(sheet):
+                checked_sheets.append(sheet)
+                for problem in self._collect_ids(sheet, ids[sheet]):
+                    yield problem
+
+        for sheet in checked_sheets:
+            for problem in self._iter_data_problems(sheet, ids):
+                yield problem
+
+    def _iter_model_problems(self, known):
+        for entity_type, entity in self.entities.items():
+            if entity.get('extends') and entity['extends'] not in known:
+                yield 'Entity type {} extends unknown entity type {}'.format(entity_type, entity['extends'])
+            elif not self.is_abstract(entity_type) and self.get_id_attribute(entity_type) is None:
+                yield 'Entity type {} has no id attribute'.format(entity_type)
+
+        for entity_type, attributes in self.attributes.items():
+            if entity_type not in self.entities:
+                yield 'Attributes of unknown entity type {}'.format(entity_type)
+                continue
+            compounds = {attribute['name'] for attribute in self.get_attributes(entity_type) if
+                         attribute['dataType'] == 'compound'}
+            for attribute in attributes:
+                name = '{}.{}'.format(entity_type, attribute['name'])
+                data_type = attribute['dataType']
+                if data_type not in self.data_types:
+                    yield 'Attribute {} has unknown dataType {}'.format(name, data_type)
+                if data_type in self.reference_types + self.multiple_reference_types and not attribute.get(
+                        'refEntity'):
+                    yield 'Attribute {} of type {} has no refEntity'.format(name, data_type)
+                elif attribute.get('refEntity') and attribute['refEntity'] not in known:
+                    yield 'Attribute {} refers to unknown entity type {}'.format(name, attribute['refEntity'])
+                if attribute.get('partOfAttribute') and attribute['partOfAttribute'] not in compounds:
+                    yield 'Attribute {} is part of {}, which is not a compound attribute of {}'.format(
+                        name, attribute['partOfAttribute'], entity_type)
+                if data_type == 'enum' and not attribute.get('enumOptions'):
+                    yield 'Attribute {} of type enum has no enumOptions'.format(name)
+
+    def _collect_ids(self, sheet, ids):
+        id_attr = self.get_id_attribute(sheet)
+        for row_number, row in self.iter_numbered_rows(sheet):
+            value = row.get(id_attr)
+            if self.is_empty(value):
+                yield '{} row {}: no value for id attribute {}'.format(sheet, row_number, id_attr)
+                continue
+            entity_id = self.to_text(value)
+            if entity_id in ids:
+                yield '{} row {}: duplicate id {}'.format(sheet, row_number, entity_id)
+            ids.add(entity_id)
+
+    def _iter_data_problems(self, sheet, ids):
+        attributes = {attribute['name']: attribute for attribute in self.get_attributes(sheet)}
+        id_attr = self.get_id_attribute(sheet)
+        for column in self.get_columns(sheet):
+            if column not in attributes:
+                yield 'Sheet {} has column {}, which is not an attribute of {}'.format(sheet, column, sheet)
+
+        for row_number, row in self.iter_numbered_rows(sheet):
+            for name, value in row.items():
+                attribute = attributes.get(name)
+                if attribute is None or attribute['dataType'] == 'compound':
+                    continue
+                if self.is_empty(value):
+                    if name != id_attr and attribute.get('nillable') is not None and not self.is_true(
+                            attribute['nillable']):
+                        yield '{} row {}: no value for required attribute {}'.format(sheet, row_number, name)
+                    continue
+                problem = self.check_value(attribute, value, ids)
+                if problem:
+                    yield '{} row {}: {} {}'.format(sheet, row_number, name, problem)
+
+    @classmethod
+    def check_value(cls, attribute, value, ids):
+        # Returns what is wrong with the value of the attribute, or None when it can be imported. References can only
+        # be checked when the ids of the referenced entity type are known (when its rows are in the workbook).
+        data_type = attribute['dataType']
+        try:
+            converted = cls.convert_value(data_type, value)
+            if data_type == 'date' and not isinstance(value, datetime.date):
+                datetime.date.fromisoformat(converted)
+            elif data_type == 'datetime' and not isinstance(value, datetime.date):
+                datetime.datetime.fromisoformat(converted)
+        except (ValueError, TypeError):
+            return 'has value [{}], which is not a valid {}'.format(value, data_type)
+        if data_type == 'bool' and not isinstance(value, bool) and cls.to_text(value).lower() not in ('true',
+                                                                                                      'false'):
+            return 'has value [{}], which is not a valid bool'.format(value)
+        if data_type == 'enum':
+            options = [option.strip() for option in str(attribute.get('enumOptions') or '').split(',')]
+            if converted not in options:
+                return 'has value [{}], which is not one of the options {}'.format(converted, ','.join(options))
+        if data_type == 'email' and '@' not in converted:
+            return 'has value [{}], which is not a valid email address'.format(converted)
+        ref_ids = ids.get(attribute.get('refEntity'))
+        if ref_ids is not None:
+            references = converted if isinstance(converted, list) else [converted]
+            unknown = [reference for reference in references if reference not in ref_ids]
+            if unknown:
+                return 'refers to unknown {} [{}]'.format(attribute['refEntity'], ','.join(unknown))
+        return None
+
+    def split(self, directory, chunk_size=10000):
+        # Splits the workbook into workbooks with at most <chunk_size> rows of data, to be imported in waves: the
+        # chunks of a wave can be imported at the same time, the next wave starts when they are all imported. The first
+        # wave only contains the data model (the packages, entities and attributes sheets). After that, a row is always
+        # in a later wave than the rows it refers to: an entity type comes after the entity types it refers to, and
+        # rows that refer to rows of the same entity type (like parents to their children) one wave after those rows.
+        # Returns the chunks ordered by wave, as dictionaries with the path of the workbook, the wave and the number of
+        # rows per sheet.
+        sheets = [sheet for sheet in self.data_sheets if sheet not in self.entities or not self.is_abstract(sheet)]
+        generations = {sheet: self._get_generations(sheet) for sheet in sheets}
+        first_waves = {}
+        for sheet in sheets:
+            self._get_first_wave(sheet, sheets, generations, first_waves, [])
+
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        chunks = []
+        model = _ChunkWriter(os.path.join(directory, '{}_wave00_000.xlsx'.format(name)), 0)
+        for sheet in self.meta_sheets:
+            if sheet in self.workbook.sheetnames:
+                rows = self.workbook[sheet].iter_rows(values_only=True)
+                model.add_sheet(sheet, next(rows, ()))
+                for values in rows:
+                    model.append(sheet, values)
+        chunks.append(model.save())
+
+        writers = {}
+        for sheet in sheets:
+            rows = self.workbook[sheet].iter_rows(values_only=True)
+            header = next(rows, ())
+            columns = [str(column).strip() if column is not None else None for column in header]
+            id_attr = self.get_id_attribute(sheet) if sheet in self.entities else None
+            # Without id column (AUTO ids) no row can refer to another row of the sheet, so all rows are generation 0
+            id_index = columns.index(id_attr) if id_attr in columns else None
+            for values in rows:
+                if all(self.is_empty(value) for value in values):
+                    continue
+                generation = 0
+                if generations[sheet] and id_index is not None and id_index < len(values) and not self.is_empty(
+                        values[id_index]):
+                    generation = generations[sheet].get(self.to_text(values[id_index]), 0)
+                wave = first_waves[sheet] + generation
+                writer = writers.get(wave)
+                if writer is None or writer.size >= chunk_size:
+                    if writer is not None:
+                        chunks.append(writer.save())
+                    writer = writers[wave] = _ChunkWriter(os.path.join(directory, '{}_wave{:02d}_{:03d}.xlsx'.format(
+                        name, wave, len([chunk for chunk in chunks if chunk['wave'] == wave]))), wave)
+                if sheet not in writer.sheets:
+                    writer.add_sheet(sheet, header)
+                writer.append(sheet, values, count=True)
+        chunks += [writer.save() for writer in writers.values()]
+        return sorted(chunks, key=lambda chunk: (chunk['wave'], chunk['path']))
+
+    def _get_first_wave(self, sheet, sheets, generations, first_waves, path):
+        # The first wave of an entity type is the wave after the last wave of the entity types it refers to
+        if sheet in first_waves:
+            return first_waves[sheet]
+        if sheet in path:
+            raise EmxValidationError(['Entity types {} refer to each other, so the workbook cannot be split'.format(
+                ', '.join(path[path.index(sheet):]))])
+        referenced = {attribute.get('refEntity') for attribute in self.get_attributes(sheet)} & set(sheets) - {sheet}
+        first_wave = 1
+        for ref_entity in referenced:
+            last_wave = self._get_first_wave(ref_entity, sheets, generations, first_waves, path + [sheet]) + max(
+                list(generations[ref_entity].values()) + [0])
+            first_wave = max(first_wave, last_wave + 1)
+        first_waves[sheet] = first_wave
+        return first_wave
+
+    def _get_generations(self, sheet):
+        # For entity types that refer to themselves: the generation of each row, 0 for rows that do not refer to rows
+        # of the same entity type and one more than the highest generation of the referred rows for the others
+        self_references = [attribute['name'] for attribute in self.get_attributes(sheet) if
+                           attribute.get('refEntity') == sheet]
+        if not self_references:
+            return {}
+        id_attr = self.get_id_attribute(sheet)
+        references = {}
+        for row in self.iter_entities(sheet):
+            if row.get(id_attr) is None:
+                # Rows without id (AUTO ids) cannot be referred to
+                continue
+            values = [row.get(name) for name in self_references]
+            references[row[id_attr]] = {reference for value in values for reference in
+                                        (value if isinstance(value, list) else [value]) if reference is not None}
+
+        generations = {}
+        for entity_id in references:
+            stack = [entity_id]
+            path = set()
+            while stack:
+                current = stack[-1]
+                if current in generations:
+                    stack.pop()
+                    continue
+                path.add(current)
+                pending = [reference for reference in references[current] if
+                           reference in references and reference not in generations]
+                if any(reference in path for reference in pending):
+                    raise EmxValidationError(['Rows of {} refer to each other ({}), so the workbook cannot be '
+                                              'split'.format(sheet, current)])
+                if pending:
+                    stack += pending
+                else:
+                    generations[current] = 1 + max([generations[reference] for reference in references[current] if
+                                                    reference in references] + [-1])
+                    path.discard(current)
+                    stack.pop()
+        return generations
+
+
+class _ChunkWriter:
+    # Writes one chunk of a split workbook, row by row (openpyxl keeps nothing in memory in write only mode)
+    def __init__(self, path, wave):
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheets = {}
+        self.size = 0
+        self.chunk = {'path': path, 'wave': wave, 'rows': OrderedDict()}
+
+    def add_sheet(self, sheet_name, header):
+        self.sheets[sheet_name] = self.workbook.create_sheet(sheet_name)
+        self.sheets[sheet_name].append(header)
+
+    def append(self, sheet_name, values, count=False):
+        self.sheets[sheet_name].append(values)
+        if count:
+            self.chunk['rows'][sheet_name] = self.chunk['rows'].get(sheet_name, 0) + 1
+            self.size += 1
+
+    def save(self):
+        self.workbook.save(self.chunk['path'])
+        return self.chunk
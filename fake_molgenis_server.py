@@ -0,0 +1,578 @@
+import email.policy
+import functools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+class FakeMolgenisServer:
+    # A small in-memory stand-in for the MOLGENIS REST API, to try out and benchmark the MolgenisDatabase wrapper
+    # without a running MOLGENIS. Only the parts of the v1 and v2 API that the wrapper uses are implemented, including
+    # the limits of the real server (100 rows per get by default, max 10000 rows per get, max 1000 rows per add or
+    # update), the import wizard with its sys_ImportRun rows and the deletion of packages.
+    # Tables that are created with meta data (by importing an EMX workbook, or with add_table(..., attributes=...))
+    # return references like MOLGENIS does: as a dictionary with the id and label of the referenced row, or with the
+    # attributes that were asked for, like children(id) or diagnosis(*).
+    # Usage:
+    # with FakeMolgenisServer() as server:
+    #     server.import_emx('very_advanced_data_example.xlsx')
+    #     server.add_rows('root_hospital_patients', rows)
+    #     demo = MolgenisDatabase(server.url, 'admin')
+    default_num = 100
+    max_num = 10000
+    max_batch = 1000
+
+    def __init__(self, latency=0.0, import_seconds=0.0):
+        # latency: number of seconds every request takes, to simulate a server that is not on your own machine
+        # import_seconds: number of seconds an import is RUNNING before the data is imported
+        self.latency = latency
+        self.import_seconds = import_seconds
+        # Per entity type a dictionary with the rows by id, so rows can be found without going through the table
+        self.tables = {}
+        self.entity_types = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        # Requests change the tables from several threads, one request at a time may touch them
+        self.data_lock = threading.RLock()
+        self._import_runs = 0
+        self._auto_ids = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+        self.add_table('sys_ImportRun', [], attributes=[
+            {'name': name, 'fieldType': field_type} for name, field_type in
+            (('id', 'STRING'), ('status', 'ENUM'), ('message', 'TEXT'), ('progress', 'INT'),
+             ('importedEntities', 'TEXT'), ('startDate', 'DATE_TIME'), ('endDate', 'DATE_TIME'))])
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    def add_table(self, entity_type, rows, id_attribute='id', label_attribute=None, attributes=None, package=None):
+        # attributes: the meta data of the attributes as the REST API returns them, with the name of the referenced
+        # entity type as refEntity, like {'name': 'gender', 'fieldType': 'CATEGORICAL', 'refEntity': 'root_gender'}
+        with self.data_lock:
+            self.entity_types[entity_type] = _entity_type(entity_type, id_attribute, label_attribute or id_attribute,
+                                                          package, attributes or [])
+            self.tables[entity_type] = {}
+            self.add_rows(entity_type, rows)
+
+    def add_rows(self, entity_type, rows):
+        # Like on the real server, nothing is added when one of the rows has an id that exists already or refers to a
+        # row that does not exist (the rows may refer to each other)
+        with self.data_lock:
+            table = self.get_table(entity_type)
+            id_attr = self.entity_types[entity_type]['idAttribute']
+            new_rows = {}
+            for row in rows:
+                entity_id = str(row[id_attr])
+                if entity_id in table or entity_id in new_rows:
+                    raise _FakeError(400, 'Duplicate value [{}] for unique attribute [{}] from entity [{}]'.format(
+                        entity_id, id_attr, entity_type))
+                new_rows[entity_id] = self.normalize_row(entity_type, dict(row))
+            for row in new_rows.values():
+                self._check_references(entity_type, row, {entity_type: new_rows})
+            table.update(new_rows)
+
+    def update_rows(self, entity_type, updates, replace=False):
+        # Changes the values of existing rows, <updates> is a list of (id, values) tuples. With replace=True the
+        # values replace the complete rows. Nothing is updated when one of the rows does not exist or refers to a row
+        # that does not exist.
+        with self.data_lock:
+            updated_rows = {}
+            for entity_id, values in updates:
+                row = self.get_row_by_id(entity_type, entity_id)
+                updated_rows[str(entity_id)] = self.normalize_row(entity_type, dict(values) if replace else dict(
+                    row, **values))
+            for row in updated_rows.values():
+                self._check_references(entity_type, row, {})
+            for entity_id, updated_row in updated_rows.items():
+                row = self.get_row_by_id(entity_type, entity_id)
+                if replace:
+                    row.clear()
+                row.update(updated_row)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_request_log(self):
+        self.requests = []
+
+    def count_requests(self, method=None):
+        return len([request for request in self.requests if method is None or request[0] == method])
+
+    def log_request(self, method, path):
+        with self._lock:
+            self.requests.append((method, path))
+
+    def get_table(self, entity_type):
+        if entity_type not in self.tables:
+            raise _FakeError(404, 'Unknown entity type [{}]'.format(entity_type))
+        return self.tables[entity_type]
+
+    def get_rows(self, entity_type):
+        return list(self.get_table(entity_type).values())
+
+    def get_row_by_id(self, entity_type, entity_id):
+        row = self.get_table(entity_type).get(str(entity_id))
+        if row is None:
+            raise _FakeError(404, 'Unknown entity [{}] of type [{}]'.format(entity_id, entity_type))
+        return row
+
+    def delete_rows(self, entity_type, ids):
+        table = self.get_table(entity_type)
+        for entity_id in ids:
+            self.get_row_by_id(entity_type, entity_id)
+        for entity_id in ids:
+            table.pop(str(entity_id), None)
+
+    def delete_package(self, package):
+        # Removes the entity types of the package and its sub packages (like root_hospital in root)
+        deleted = [entity_type for entity_type, meta in self.entity_types.items() if meta['package'] and (
+            meta['package'] == package or meta['package'].startswith(package + '_'))]
+        if not deleted:
+            raise _FakeError(404, 'Unknown entity [{}] of type [sys_md_Package]'.format(package))
+        for entity_type in deleted:
+            del self.entity_types[entity_type]
+            del self.tables[entity_type]
+
+    def get_attributes(self, entity_type):
+        return self.entity_types[entity_type]['attributesByName']
+
+    def get_references(self, entity_type):
+        return self.entity_types[entity_type]['references']
+
+    def normalize_row(self, entity_type, row):
+        # Rows are stored with references as ids, also when they were written with the references as dictionaries
+        # (like rows that were retrieved with the API). Attributes like _href are not stored.
+        for name in [name for name in row if name.startswith('_')]:
+            del row[name]
+        for name, ref_entity in self.get_references(entity_type).items():
+            value = row.get(name)
+            if value is None and self.get_attributes(entity_type)[name]['fieldType'] in _multiple_reference_types:
+                # Multiple references without values are returned as empty lists
+                row[name] = []
+            elif isinstance(value, list):
+                row[name] = [self._reference_id(ref_entity, item) for item in value]
+            elif value is not None:
+                row[name] = self._reference_id(ref_entity, value)
+        return row
+
+    def _reference_id(self, ref_entity, value):
+        if isinstance(value, dict):
+            id_attr = self.entity_types[ref_entity]['idAttribute'] if ref_entity in self.entity_types else 'id'
+            return str(value[id_attr])
+        return str(value)
+
+    def meta(self, entity_type, attrs=None):
+        meta = self.entity_types[entity_type]
+        selected = _parse_attrs(attrs)
+        attributes = []
+        for attribute in meta['attributes']:
+            if attribute.get('attributes'):
+                parts = [self._attribute_meta(part) for part in attribute['attributes'] if
+                         selected is None or part['name'] in selected]
+                if parts:
+                    attributes.append(dict(self._attribute_meta(attribute), attributes=parts))
+            elif selected is None or attribute['name'] in selected:
+                attributes.append(self._attribute_meta(attribute))
+        return {'href': '/api/v2/' + entity_type, 'name': entity_type, 'idAttribute': meta['idAttribute'],
+                'labelAttribute': meta['labelAttribute'], 'attributes': attributes}
+
+    def _attribute_meta(self, attribute):
+        attribute_meta = {key: value for key, value in attribute.items() if key not in ('refEntity', 'attributes')}
+        ref_entity = attribute.get('refEntity')
+        if ref_entity:
+            ref_meta = self.entity_types.get(ref_entity, {})
+            attribute_meta['refEntity'] = {'href': '/api/v2/' + ref_entity, 'name': ref_entity,
+                                           'idAttribute': ref_meta.get('idAttribute'),
+                                           'labelAttribute': ref_meta.get('labelAttribute')}
+        return attribute_meta
+
+    def to_response(self, entity_type, row, attrs=None):
+        # The row as the v2 API returns it: only the attributes that were asked for, with the references expanded
+        selected = _parse_attrs(attrs)
+        references = self.get_references(entity_type)
+        id_attr = self.entity_types[entity_type]['idAttribute']
+        response = {'_href': '/api/v2/{}/{}'.format(entity_type, row[id_attr])}
+        for name, value in row.items():
+            if selected is not None and name not in selected:
+                continue
+            if name in references and value is not None:
+                sub_attrs = selected.get(name) if selected is not None else None
+                if isinstance(value, list):
+                    value = [self._expand(references[name], item, sub_attrs) for item in value]
+                else:
+                    value = self._expand(references[name], value, sub_attrs)
+            response[name] = value
+        return response
+
+    def _expand(self, ref_entity, ref_id, attrs):
+        ref_row = self.tables.get(ref_entity, {}).get(str(ref_id))
+        if ref_row is None:
+            return {'_href': '/api/v2/{}/{}'.format(ref_entity, ref_id)}
+        if attrs:
+            return self.to_response(ref_entity, ref_row, attrs)
+        # Not expanded: only the id and the label of the referenced row
+        meta = self.entity_types[ref_entity]
+        return self.to_response(ref_entity, ref_row,
+                                ','.join(OrderedDict.fromkeys([meta['idAttribute'], meta['labelAttribute']])))
+
+    def import_emx(self, path):
+        # Imports an EMX workbook like the import wizard does: the entity types of the workbook are created (this fails
+        # when one of them exists already) and the rows of the data sheets are added, or updated when a row with the
+        # same id exists. Nothing is imported when a reference points to a row that does not exist.
+        # Returns the number of rows per entity type.
+        from emx import EmxWorkbook
+        with EmxWorkbook(path) as workbook, self.data_lock:
+            new_entity_types = {}
+            for entity_type in workbook.entities:
+                if entity_type in self.entity_types:
+                    raise _FakeError(400, 'EntityType with id [{}] already exists'.format(entity_type))
+                if not workbook.is_abstract(entity_type):
+                    new_entity_types[entity_type] = self._entity_type_from_emx(workbook, entity_type)
+
+            entity_types = dict(self.entity_types, **new_entity_types)
+            staged = {}
+            for sheet in workbook.data_sheets:
+                if sheet not in entity_types:
+                    raise _FakeError(400, 'Unknown entity type [{}]'.format(sheet))
+                id_attr = entity_types[sheet]['idAttribute']
+                data_types = None
+                if sheet not in workbook.entities:
+                    # The rows of an existing entity type are read with its meta data
+                    data_types = {name: attribute['fieldType'].lower().replace('date_time', 'datetime') for
+                                  name, attribute in entity_types[sheet]['attributesByName'].items()}
+                rows = workbook.iter_entities(sheet, data_types)
+                if entity_types[sheet]['attributesByName'].get(id_attr, {}).get('auto'):
+                    # Like MOLGENIS, rows of entity types with an AUTO id attribute get a generated id
+                    rows = (dict(row, **{id_attr: row.get(id_attr) or self._generate_id()}) for row in rows)
+                staged[sheet] = {str(row[id_attr]): row for row in rows}
+
+            previous = self.entity_types
+            self.entity_types = entity_types
+            try:
+                for entity_type, rows in staged.items():
+                    for row in rows.values():
+                        self.normalize_row(entity_type, row)
+                        self._check_references(entity_type, row, staged)
+            except _FakeError:
+                self.entity_types = previous
+                raise
+            for entity_type in new_entity_types:
+                self.tables[entity_type] = {}
+            for entity_type, rows in staged.items():
+                self.tables[entity_type].update(rows)
+        return {entity_type: len(rows) for entity_type, rows in staged.items()}
+
+    def _generate_id(self):
+        self._auto_ids += 1
+        return 'auto{:09d}'.format(self._auto_ids)
+
+    def _entity_type_from_emx(self, workbook, entity_type):
+        attributes = []
+        compounds = {}
+        for emx_attribute in workbook.get_attributes(entity_type):
+            field_type = emx_attribute['dataType'].upper().replace('DATETIME', 'DATE_TIME')
+            attribute = {'name': emx_attribute['name'], 'label': emx_attribute.get('label') or emx_attribute['name'],
+                         'fieldType': field_type,
+                         'nillable': emx_attribute.get('nillable') is None or workbook.is_true(
+                             emx_attribute.get('nillable'))}
+            if emx_attribute.get('idAttribute') == 'AUTO':
+                attribute['auto'] = True
+            if emx_attribute.get('refEntity'):
+                attribute['refEntity'] = emx_attribute['refEntity']
+            if emx_attribute.get('enumOptions'):
+                attribute['enumOptions'] = emx_attribute['enumOptions'].split(',')
+            if field_type == 'COMPOUND':
+                attribute['attributes'] = compounds[attribute['name']] = []
+            if emx_attribute.get('partOfAttribute') in compounds:
+                compounds[emx_attribute['partOfAttribute']].append(attribute)
+            else:
+                attributes.append(attribute)
+        return _entity_type(entity_type, workbook.get_id_attribute(entity_type),
+                            workbook.get_label_attribute(entity_type), workbook.entities[entity_type].get('package'),
+                            attributes)
+
+    def _check_references(self, entity_type, row, staged):
+        for name, ref_entity in self.get_references(entity_type).items():
+            for ref_id in _reference_ids(row.get(name)):
+                if ref_id not in staged.get(ref_entity, {}) and ref_id not in self.tables.get(ref_entity, {}):
+                    raise _FakeError(400, 'Unknown xref value [{}] for attribute [{}] of entity [{}]'.format(
+                        ref_id, name, entity_type))
+
+    def start_import(self, path):
+        # Starts importing the file in the background and returns the id of its sys_ImportRun row, which is RUNNING
+        # for <import_seconds> seconds and then FINISHED or FAILED
+        with self.data_lock:
+            self._import_runs += 1
+            run_id = 'import{:06d}'.format(self._import_runs)
+            self.add_rows('sys_ImportRun', [{'id': run_id, 'status': 'RUNNING', 'progress': 0,
+                                             'startDate': time.strftime('%Y-%m-%dT%H:%M:%S')}])
+        threading.Thread(target=self._run_import, args=(run_id, path), daemon=True).start()
+        return run_id
+
+    def _run_import(self, run_id, path):
+        time.sleep(self.import_seconds)
+        try:
+            imported = self.import_emx(path)
+            changes = {'status': 'FINISHED', 'importedEntities': ','.join(imported),
+                       'message': 'Imported {} rows'.format(sum(imported.values()))}
+        except Exception as error:
+            changes = {'status': 'FAILED', 'message': getattr(error, 'message', str(error))}
+        finally:
+            os.remove(path)
+        with self.data_lock:
+            self.get_row_by_id('sys_ImportRun', run_id).update(changes, progress=100,
+                                                                endDate=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+class _FakeError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+_multiple_reference_types = ('MREF', 'CATEGORICAL_MREF', 'ONE_TO_MANY')
+
+
+def _entity_type(name, id_attribute, label_attribute, package, attributes):
+    # Besides the meta data, the attributes are kept by name (also the parts of compound attributes) together with
+    # the referenced entity type of each (multiple) reference attribute, which are needed for every row in a response
+    attributes_by_name = {part['name']: part for attribute in attributes for part in
+                          [attribute] + attribute.get('attributes', [])}
+    return {'name': name, 'idAttribute': id_attribute, 'labelAttribute': label_attribute, 'package': package,
+            'attributes': attributes, 'attributesByName': attributes_by_name,
+            'references': {attribute_name: attribute['refEntity'] for attribute_name, attribute in
+                           attributes_by_name.items() if attribute.get('refEntity')}}
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_attrs(attrs):
+    # children(id),gender becomes {'children': 'id', 'gender': None}, no attrs (or *) becomes None (everything).
+    # The same attrs are parsed for every row, so the result is cached (and should not be changed).
+    if not attrs:
+        return None
+    selected = {}
+    for attr in re.split(r',(?![^(]*\))', attrs):
+        match = re.match(r'^([^(]+)(?:\((.*)\))?$', attr.strip())
+        selected[match.group(1)] = match.group(2)
+    return None if '*' in selected else selected
+
+
+def _reference_ids(value):
+    # References are stored as ids, or as dictionaries with an id when the test data was copied from a real server
+    values = value if isinstance(value, list) else [value]
+    return [str(item['id']) if isinstance(item, dict) else str(item) for item in values if item is not None]
+
+
+def _matches(row, query):
+    # Supports the subset of RSQL that is used in the demo: ==, !=, =in=, =gt=, =ge=, =lt= and =le= combined with ;
+    if not query:
+        return True
+    for constraint in query.split(';'):
+        in_match = re.match(r'^(\w+)=in=\((.*)\)$', constraint)
+        if in_match:
+            attribute, values = in_match.groups()
+            wanted = [value.strip('"') for value in values.split(',')]
+            if not set(_reference_ids(row.get(attribute))) & set(wanted):
+                return False
+            continue
+        attribute, operator, value = re.match(r'^(\w+)(==|!=|=gt=|=ge=|=lt=|=le=)(.*)$', constraint).groups()
+        value = value.strip('"')
+        if operator in _comparisons:
+            if row.get(attribute) is None or not _compare(operator, row[attribute], value):
+                return False
+            continue
+        found = value in _reference_ids(row.get(attribute))
+        if found != (operator == '=='):
+            return False
+    return True
+
+
+_comparisons = {'=gt=': lambda a, b: a > b, '=ge=': lambda a, b: a >= b, '=lt=': lambda a, b: a < b,
+                '=le=': lambda a, b: a <= b}
+
+
+def _compare(operator, row_value, query_value):
+    # Numbers are compared as numbers, everything else (like dates) as text
+    if isinstance(row_value, (int, float)) and not isinstance(row_value, bool) and re.match(r'^-?[\d.]+$',
+                                                                                              query_value):
+        query_value = float(query_value)
+    else:
+        row_value = str(row_value)
+    return _comparisons[operator](row_value, query_value)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body of a response are written separately; without this every request on a kept alive
+    # connection waits ~40ms for the delayed ACK of the client, which would dwarf everything we want to measure
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        self.fake.log_request(method, self.path)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        body = self._read_body()
+        path = [unquote(part) for part in url.path.split('/') if part]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if path[:3] == ['plugin', 'importwizard', 'importFile'] and method == 'POST':
+                handler = self._import_file
+            elif path[0] == 'api' and len(path) > 2:
+                handler = getattr(self, '_{}_{}'.format(path[1], method.lower()), None)
+            else:
+                raise _FakeError(404, 'Unknown path [{}]'.format(url.path))
+            if handler is None:
+                raise _FakeError(405, 'Method [{}] not supported'.format(method))
+            with self.fake.data_lock:
+                status, response = handler(path[2:], params, body)
+        except _FakeError as error:
+            status, response = error.status, {'errors': [{'message': error.message}]}
+        self._send(status, response)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        content = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(content.decode('utf-8')) if content else None
+        except ValueError:
+            return content
+
+    def _send(self, status, response):
+        if isinstance(response, str):
+            content, content_type = response.encode('utf-8'), 'text/plain'
+        else:
+            content = json.dumps(response).encode('utf-8') if response is not None else b''
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _import_file(self, path, params, body):
+        # The file is sent as multipart form data, like a browser would upload it
+        form = BytesParser(policy=email.policy.default).parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(self.headers['Content-Type']).encode('utf-8') + body)
+        for part in form.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                extension = os.path.splitext(part.get_filename() or '')[1]
+                if extension != '.xlsx':
+                    raise _FakeError(400, 'Unsupported file type [{}], only .xlsx is supported'.format(extension))
+                handle, file_name = tempfile.mkstemp(suffix=extension)
+                with os.fdopen(handle, 'wb') as upload:
+                    upload.write(part.get_payload(decode=True))
+                return 201, '/api/v2/sys_ImportRun/' + self.fake.start_import(file_name)
+        raise _FakeError(400, 'No file uploaded')
+
+    def _v1_post(self, path, params, body):
+        if path == ['login']:
+            return 200, {'token': 'fake-token', 'username': body['username']}
+        if path == ['logout']:
+            return 200, None
+        raise _FakeError(405, 'Method not supported')
+
+    def _v1_put(self, path, params, body):
+        entity_type, entity_id, attribute = path
+        self.fake.update_rows(entity_type, [(entity_id, {attribute: body})])
+        return 200, None
+
+    def _v1_delete(self, path, params, body):
+        entity_type = path[0]
+        if entity_type == 'sys_md_Package':
+            self.fake.delete_package(path[1])
+        elif len(path) == 1:
+            self.fake.delete_rows(entity_type, list(self.fake.get_table(entity_type)))
+        else:
+            self.fake.delete_rows(entity_type, [path[1]])
+        return 204, None
+
+    def _v2_get(self, path, params, body):
+        entity_type = path[0]
+        attrs = params.get('attrs')
+        if len(path) == 2:
+            return 200, self.fake.to_response(entity_type, self.fake.get_row_by_id(entity_type, path[1]), attrs)
+
+        rows = [row for row in self.fake.get_rows(entity_type) if _matches(row, params.get('q'))]
+        if 'sort' in params:
+            attribute, _, order = params['sort'].partition(':')
+            rows = sorted(rows, key=lambda row: str(row.get(attribute, '')), reverse=order.lower() == 'desc')
+        num = int(params.get('num', self.fake.default_num))
+        start = int(params.get('start', 0))
+        if num > self.fake.max_num:
+            raise _FakeError(400, 'num must be less than or equal to {}'.format(self.fake.max_num))
+        items = [self.fake.to_response(entity_type, row, attrs) for row in rows[start:start + num]]
+        return 200, {'href': '/api/v2/' + entity_type, 'meta': self.fake.meta(entity_type, attrs), 'start': start,
+                     'num': num, 'total': len(rows), 'items': items}
+
+    def _v2_post(self, path, params, body):
+        entity_type = path[0]
+        entities = self._check_batch(body)
+        id_attr = self.fake.entity_types[entity_type]['idAttribute']
+        self.fake.add_rows(entity_type, entities)
+        return 201, {'location': '/api/v2/' + entity_type,
+                     'resources': [{'href': '/api/v2/{}/{}'.format(entity_type, entity[id_attr])}
+                                   for entity in entities]}
+
+    def _v2_put(self, path, params, body):
+        entity_type = path[0]
+        entities = self._check_batch(body)
+        id_attr = self.fake.entity_types[entity_type]['idAttribute']
+        if len(path) == 2:
+            self.fake.update_rows(entity_type, [(entity[id_attr], {path[1]: entity[path[1]]}) for entity in entities])
+        else:
+            self.fake.update_rows(entity_type, [(entity[id_attr], entity) for entity in entities], replace=True)
+        return 200, None
+
+    def _v2_delete(self, path, params, body):
+        self.fake.delete_rows(path[0], body['entityIds'])
+        return 204, None
+
+    def _check_batch(self, body):
+        entities = body['entities']
+        if len(entities) > self.fake.max_batch:
+            raise _FakeError(400, 'Number of entities cannot be more than {}'.format(self.fake.max_batch))
+        return entities
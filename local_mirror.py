@@ -0,0 +1,173 @@
+import datetime
+import json
+import re
+import sqlite3
+import threading
+
+from Demo import ArrowConverter, MolgenisDatabase
+
+
+class LocalMirror:
+    # Keeps a copy of MOLGENIS tables in a local SQLite database, so reports can query them without downloading the
+    # complete tables every time. Per table a high water mark is remembered: the highest value of an attribute that
+    # only grows, like a modification date (lastUpdated) or a numeric id. The next sync only retrieves the rows with a
+    # value greater than or equal to the mark, which are added or replaced in the mirror.
+    # Rows that were deleted on the server are only removed from the mirror by a full sync (full=True).
+    # References are stored as ids (xref) or lists of ids (mref), so they can be queried like in RSQL.
+    # Usage:
+    # mirror = LocalMirror(demo, 'hospital.sqlite')
+    # mirror.sync('root_hospital_patients', high_water_attribute='lastUpdated')
+    # mirror.query('root_hospital_patients', 'residence==london;gender==f')
+    def __init__(self, molgenis_db, path='molgenis_mirror.sqlite'):
+        self.molgenis_db = molgenis_db
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS mirror_rows (entity_type TEXT, id TEXT, data TEXT, '
+                                    'PRIMARY KEY (entity_type, id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS mirror_state (entity_type TEXT PRIMARY KEY, '
+                                    'high_water_attribute TEXT, high_water TEXT, last_sync TEXT)')
+
+    def close(self):
+        self.connection.close()
+
+    def get_high_water(self, entity_type):
+        state = self.connection.execute('SELECT high_water_attribute, high_water FROM mirror_state '
+                                        'WHERE entity_type = ?', (entity_type,)).fetchone()
+        return (state[0], json.loads(state[1])) if state else (None, None)
+
+    def sync(self, entity_type, high_water_attribute=None, attributes=None, full=False, page_size=10000):
+        # Brings the mirror of the table up to date and returns the number of rows retrieved from the server. Without
+        # high water attribute (or with full=True) the complete table is retrieved and replaces the mirror.
+        id_attr = self.molgenis_db.get_meta(entity_type)['idAttribute']
+        # Rows are stored by id and the mark is moved with the high water attribute, so both are always retrieved
+        for key in (id_attr, high_water_attribute):
+            if key is not None:
+                attributes = MolgenisDatabase._with_key(attributes, key)
+        meta = self.molgenis_db.get_meta(entity_type, attributes)
+        references = self._get_references(meta)
+        previous_attribute, high_water = self.get_high_water(entity_type)
+        if full or high_water_attribute is None or previous_attribute != high_water_attribute:
+            high_water = None
+
+        q = None
+        if high_water is not None:
+            q = '{}=ge={}'.format(high_water_attribute, self._format_rsql_value(high_water))
+
+        number_of_rows = 0
+        with self._lock, self.connection:
+            if high_water is None:
+                self.connection.execute('DELETE FROM mirror_rows WHERE entity_type = ?', (entity_type,))
+            for page in self.molgenis_db.iter_pages(entity_type, q=q, attributes=attributes, page_size=page_size):
+                rows = [self._flatten(row, references) for row in page]
+                self.connection.executemany('INSERT OR REPLACE INTO mirror_rows VALUES (?, ?, ?)',
+                                            [(entity_type, str(row[id_attr]), json.dumps(row)) for row in rows])
+                if high_water_attribute is not None:
+                    high_water = max([row[high_water_attribute] for row in rows if
+                                      row.get(high_water_attribute) is not None] + (
+                                         [high_water] if high_water is not None else []), default=None)
+                number_of_rows += len(rows)
+            self.connection.execute('INSERT OR REPLACE INTO mirror_state VALUES (?, ?, ?, ?)',
+                                    (entity_type, high_water_attribute, json.dumps(high_water),
+                                     datetime.datetime.now().isoformat()))
+        return number_of_rows
+
+    @staticmethod
+    def _get_references(meta):
+        # Returns the id attribute of the referenced table of each (multiple) reference attribute that is known
+        references = {}
+        for attribute in meta.get('attributes', []):
+            for part in attribute.get('attributes', [attribute]):
+                if part.get('fieldType') in ArrowConverter.reference_types + ArrowConverter.multiple_reference_types:
+                    references[part['name']] = (part.get('refEntity') or {}).get('idAttribute')
+        return references
+
+    @staticmethod
+    def _flatten(row, references):
+        flat = {}
+        for name, value in row.items():
+            if name.startswith('_'):
+                continue
+            ref_id = references.get(name)
+            if isinstance(value, dict):
+                value = ArrowConverter.reference_id_and_label(value, ref_id, None)[0]
+            elif isinstance(value, list):
+                value = [ArrowConverter.reference_id_and_label(item, ref_id, None)[0] for item in value]
+            flat[name] = value
+        return flat
+
+    @staticmethod
+    def _format_rsql_value(value):
+        return '"{}"'.format(value) if isinstance(value, str) else str(value)
+
+    def query(self, entity_type, q=None, sort_column=None, sort_order=None, num=None, start=0):
+        # Queries the mirror with (a subset of) RSQL: the operators ==, !=, =in=, =out=, =gt=, =ge=, =lt= and =le=,
+        # combined with ; (and) and , (or). Parentheses are not supported; and binds stronger than or, like in RSQL.
+        sql = 'SELECT data FROM mirror_rows WHERE entity_type = ?'
+        params = [entity_type]
+        if q:
+            condition, condition_params = self._translate_query(q)
+            sql += ' AND ({})'.format(condition)
+            params += condition_params
+        if sort_column:
+            sql += ' ORDER BY json_extract(data, ?) {}'.format('DESC' if sort_order == 'desc' else 'ASC')
+            params.append(self._path(sort_column))
+        if num is not None or start:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [-1 if num is None else num, start]
+        return [json.loads(data) for data, in self.connection.execute(sql, params)]
+
+    def count(self, entity_type, q=None):
+        sql = 'SELECT COUNT(*) FROM mirror_rows WHERE entity_type = ?'
+        params = [entity_type]
+        if q:
+            condition, condition_params = self._translate_query(q)
+            sql += ' AND ({})'.format(condition)
+            params += condition_params
+        return self.connection.execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _path(attribute):
+        return '$."{}"'.format(attribute)
+
+    @staticmethod
+    def _values(value):
+        # RSQL does not say whether a value is a number or text, so compare with both
+        value = value.strip('"\'')
+        try:
+            return [value, float(value)]
+        except ValueError:
+            return [value, value]
+
+    def _translate_query(self, q):
+        or_conditions = []
+        params = []
+        # Split on the commas that are not part of an =in=(...) list
+        for or_part in re.split(r',(?![^(]*\))', q):
+            and_conditions = []
+            for constraint in or_part.split(';'):
+                condition, condition_params = self._translate_constraint(constraint)
+                and_conditions.append(condition)
+                params += condition_params
+            or_conditions.append('({})'.format(' AND '.join(and_conditions)))
+        return ' OR '.join(or_conditions), params
+
+    def _translate_constraint(self, constraint):
+        match = re.match(r'^(\w+)(==|!=|=in=|=out=|=gt=|=ge=|=lt=|=le=)(.*)$', constraint.strip())
+        if not match:
+            raise ValueError('Unsupported query: {}'.format(constraint))
+        attribute, operator, value = match.groups()
+        path = self._path(attribute)
+        # json_each works for single values and for lists (multiple references)
+        contains = 'EXISTS (SELECT 1 FROM json_each(data, ?) WHERE value IN ({}))'
+        if operator in ('==', '!='):
+            values = self._values(value)
+            condition = contains.format('?, ?')
+            return (condition if operator == '==' else 'NOT ' + condition), [path] + values
+        if operator in ('=in=', '=out='):
+            values = [item for part in value.strip('()').split(',') for item in self._values(part)]
+            condition = contains.format(', '.join('?' * len(values)))
+            return (condition if operator == '=in=' else 'NOT ' + condition), [path] + values
+        sql_operator = {'=gt=': '>', '=ge=': '>=', '=lt=': '<', '=le=': '<='}[operator]
+        text, number = self._values(value)
+        return 'json_extract(data, ?) {} ?'.format(sql_operator), [path, number]
@@ -10,4 +10,6 @@ setup(
     packages=find_packages(),
     install_requires=['molgenis-py-client>=2.1.0', 'termcolor==1.1.0', 'yaspin>=0.14.3', 'natsort==6.0.0',
                       'names==0.3.0'],
+    extras_require={'async': ['aiohttp>=3.6'], 'columnar': ['pyarrow>=1.0', 'pandas>=1.0'],
+                    'emx': ['openpyxl>=3.0']},
 )